@@ -32,6 +32,11 @@ from app.utils.bazos_scraper_fixed import BazosScraper
 from app.models import db, User, UserKeyword, UserAd, UserFavorite, UserStats
 from app.auth import AuthService, require_auth, rate_limit_auth
 from app.user_service import UserService
+from app.migrations import run_migrations
+from app.db_writer import db_writer
+from app.password_hasher import password_hasher
+from app.read_replica import REPLICA_BIND, init_read_replica, read_from_replica
+from app.data_version import etag_by_data_version
 from utils.stats_tracker import StatsTracker
 
 import threading
@@ -85,6 +90,14 @@ def create_app():
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Optional read replica for read-only requests
+    read_url = os.getenv('DATABASE_READ_URL')
+    if read_url:
+        if read_url.startswith('postgres://'):
+            read_url = read_url.replace('postgres://', 'postgresql://', 1)
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: read_url}
+        logger.info(f"Routing read-only requests to replica: {read_url.split('@')[0]}@...")
+
     # Configure database engine options based on database type
     if database_url and 'postgresql' in database_url:
         # PostgreSQL configuration
@@ -176,6 +189,8 @@ app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
 # Initialize extensions
 db.init_app(app)
+db_writer.init_app(app)
+init_read_replica(app)
 jwt = JWTManager(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'auth.login'
@@ -297,7 +312,7 @@ def save_keywords(keywords):
 
 # Load saved advertisements
 def load_ads():
-    """DEPRECATED: Use user_service.get_user_ads() instead"""
+    """DEPRECATED: Use user_service.get_user_ads_page() instead"""
     if os.path.exists(ADS_FILE):
         try:
             with open(ADS_FILE, 'r', encoding='utf-8-sig') as f:
@@ -774,6 +789,7 @@ def get_notifications():
     return jsonify({'new_ads': [], 'deleted_ads': [], 'keywords_with_changes': []})
 
 @app.route('/api/health')
+@read_from_replica
 def health_check():
     """Health check endpoint for container orchestration (Coolify, Docker, etc.)"""
     try:
@@ -832,7 +848,8 @@ def debug_api():
             "database_exists": os.path.exists("data/bazos_checker.db"),
             "keywords_file_exists": os.path.exists("data/keywords.json"),
             "ads_file_exists": os.path.exists("data/ads.json"), 
-            "stats_file_exists": os.path.exists("data/stats.json")
+            "stats_file_exists": os.path.exists("data/stats.json"),
+            "stats_backend": type(stats.backend).__name__
         },
         "database_status": {
             "total_users": "unknown",
@@ -936,6 +953,7 @@ if os.path.exists(ADS_FILE):
 with app.app_context():
     try:
         db.create_all()
+        run_migrations()
         print("✅ Database tables initialized")
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
@@ -1022,7 +1040,7 @@ def logout():
 def get_current_user():
     """Get current user information"""
     try:
-        user = g.current_user
+        user = db.session.get(User, g.current_user.id)
         return jsonify({
             'success': True,
             'user': user.to_dict()
@@ -1047,7 +1065,7 @@ def change_password():
         if not current_password or not new_password:
             return jsonify({'success': False, 'error': 'Current and new passwords are required'}), 400
         
-        user = g.current_user
+        user = db.session.get(User, g.current_user.id)
         
         # Verify current password
         if not user.check_password(current_password):
@@ -1058,9 +1076,14 @@ def change_password():
         if not valid:
             return jsonify({'success': False, 'error': message}), 400
         
-        # Update password
-        user.set_password(new_password)
-        db.session.commit()
+        # Update password, hashed before queueing so bcrypt does not hold up the writer
+        user_id = user.id
+        password_hash = password_hasher.hash(new_password)
+        
+        def _change_password():
+            db.session.get(User, user_id).password_hash = password_hash
+        
+        db_writer.run(_change_password)
         
         return jsonify({'success': True, 'message': 'Password changed successfully'}), 200
         
@@ -1076,6 +1099,7 @@ def change_password():
 # User-specific routes (NEW - Database-based)
 @app.route('/api/user/keywords', methods=['GET', 'POST'])
 @require_auth
+@etag_by_data_version
 def manage_user_keywords():
     """Manage user keywords"""
     user_id = g.current_user.id
@@ -1142,27 +1166,80 @@ def delete_user_keyword(keyword):
 
 @app.route('/api/user/ads')
 @require_auth
+@read_from_replica
+@etag_by_data_version
 def get_user_ads():
-    """Get user ads"""
+    """Get user ads, one keyset-paginated page at a time"""
     try:
         user_id = g.current_user.id
         keyword = request.args.get('keyword')
+        cursor = request.args.get('cursor')
         
-        if keyword:
-            ads = user_service.get_user_ads(user_id, keyword)
-            return jsonify({'success': True, 'ads': ads}), 200
-        else:
-            ads = user_service.get_user_ads(user_id)
-            return jsonify({'success': True, 'ads': ads}), 200
-            
+        # Get optional limit parameter (default to 500, max 500)
+        limit = request.args.get('limit', 500, type=int)
+        limit = min(max(limit, 10), 500)  # Clamp between 10 and 500
+        
+        # Archived (long-deleted) ads are only read when explicitly requested
+        include_archived = request.args.get('include_archived', 'false').lower() == 'true'
+        
+        ads, next_cursor = user_service.get_user_ads_page(
+            user_id, limit=limit, cursor=cursor, keyword=keyword, include_archived=include_archived
+        )
+        return jsonify({'success': True, 'ads': ads, 'next_cursor': next_cursor}), 200
+        
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
     except Exception as e:
         logger.error(f"Get user ads error: {e}")
         return jsonify({'success': False, 'error': 'Failed to get ads'}), 500
 
+@app.route('/api/user/ads/search')
+@require_auth
+@read_from_replica
+@etag_by_data_version
+def search_user_ads():
+    """Full-text search of the user's ads by title and description"""
+    try:
+        user_id = g.current_user.id
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Search query is required'}), 400
+
+        limit = request.args.get('limit', 100, type=int)
+        limit = min(max(limit, 10), 500)  # Clamp between 10 and 500
+        include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
+
+        ads = user_service.search_user_ads(user_id, query, limit=limit, include_deleted=include_deleted)
+        return jsonify({'success': True, 'ads': ads, 'query': query}), 200
+
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Search query must contain letters or digits'}), 400
+    except Exception as e:
+        logger.error(f"Search user ads error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to search ads'}), 500
+
+@app.route('/api/user/ads/<ad_id>/price-history')
+@require_auth
+@read_from_replica
+@etag_by_data_version
+def get_ad_price_history(ad_id):
+    """Price timeline of one of the user's ads"""
+    try:
+        history = user_service.get_ad_price_history(g.current_user.id, ad_id)
+        if history is None:
+            return jsonify({'success': False, 'error': 'Ad not found'}), 404
+        return jsonify({'success': True, 'ad_id': ad_id, 'history': history}), 200
+
+    except Exception as e:
+        logger.error(f"Get price history error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to get price history'}), 500
+
 @app.route('/api/user/recent-ads')
 @require_auth
+@read_from_replica
+@etag_by_data_version
 def get_user_recent_ads():
-    """Get user recent ads"""
+    """Get user recent ads, one keyset-paginated page at a time"""
     try:
         user_id = g.current_user.id
         
@@ -1173,13 +1250,24 @@ def get_user_recent_ads():
         # Get optional include_deleted parameter
         include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
         
-        logger.info(f"Getting recent ads for user {user_id} (limit: {limit}, include_deleted: {include_deleted})")
+        # Archived (long-deleted) ads are only read when explicitly requested
+        include_archived = request.args.get('include_archived', 'false').lower() == 'true'
         
-        ads = user_service.get_user_recent_ads(user_id, limit=limit, include_deleted=include_deleted)
+        # Opaque cursor from a previous page's next_cursor
+        cursor = request.args.get('cursor')
+        
+        logger.info(f"Getting recent ads for user {user_id} (limit: {limit}, include_deleted: {include_deleted}, include_archived: {include_archived}, cursor: {cursor is not None})")
+        
+        ads, next_cursor = user_service.get_user_ads_page(
+            user_id, limit=limit, cursor=cursor, include_deleted=include_deleted,
+            include_archived=include_archived
+        )
         logger.info(f"Retrieved {len(ads)} recent ads for user {user_id}")
         
-        return jsonify({'success': True, 'ads': ads}), 200
+        return jsonify({'success': True, 'ads': ads, 'next_cursor': next_cursor}), 200
         
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
     except Exception as e:
         logger.error(f"Get user recent ads error: {e}")
         import traceback
@@ -1188,6 +1276,8 @@ def get_user_recent_ads():
 
 @app.route('/api/user/favorites', methods=['GET', 'POST'])
 @require_auth
+@read_from_replica
+@etag_by_data_version
 def manage_user_favorites():
     """Manage user favorites"""
     user_id = g.current_user.id
@@ -1220,6 +1310,7 @@ def manage_user_favorites():
 
 @app.route('/api/user/stats')
 @require_auth
+@read_from_replica
 def get_user_stats():
     """Get user statistics"""
     try:
@@ -1231,6 +1322,20 @@ def get_user_stats():
         logger.error(f"Get user stats error: {e}")
         return jsonify({'success': False, 'error': 'Failed to get stats'}), 500
 
+@app.route('/api/user/stats/time-on-market')
+@require_auth
+@read_from_replica
+@etag_by_data_version
+def get_time_on_market():
+    """How long the user's ads stayed listed, per keyword"""
+    try:
+        distributions = user_service.get_time_on_market(g.current_user.id)
+        return jsonify({'success': True, 'keywords': distributions}), 200
+        
+    except Exception as e:
+        logger.error(f"Get time on market error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to get time on market'}), 500
+
 @app.route('/api/user/manual-check')
 @require_auth
 def manual_user_check():
@@ -1248,10 +1353,11 @@ def manual_user_check():
         
         try:
             success, new_ads, deleted_ads = user_service.check_user_ads(user_id)
+            # A GET that writes - keep the user's next reads on the primary
+            g.wrote_data = True
             
             if success:
-                # Ensure database session is committed and closed
-                db.session.commit()
+                # The check wrote through db_writer, only end this session's read transaction
                 db.session.close()
                 
                 logger.info(f"Manual check completed for user {user_id}: {len(new_ads)} new ads, {len(deleted_ads)} deleted ads")
@@ -1260,7 +1366,8 @@ def manual_user_check():
                     'success': True,
                     'message': 'Manual check completed',
                     'new_ads': len(new_ads),
-                    'deleted_ads': len(deleted_ads)
+                    'deleted_ads': len(deleted_ads),
+                    'data_version': UserStats.current_version(user_id)
                 }), 200
             else:
                 logger.error(f"Manual check failed for user {user_id}")
@@ -1282,15 +1389,15 @@ def check_all_users_ads():
     
     try:
         with app.app_context():
-            from app.models import User
-            
-            users = User.query.filter_by(is_active=True).all()
-            logger.info(f"Running scheduled check for {len(users)} active users")
+            logger.info("Running scheduled check for active users")
             
+            users_checked = 0
             total_new_ads = 0
             total_deleted_ads = 0
             
-            for user in users:
+            # Users are streamed in bounded batches, so memory does not grow with the user count
+            for user in user_service.iter_users_to_check():
+                users_checked += 1
                 try:
                     success, new_ads, deleted_ads = user_service.check_user_ads(user.id)
                     if success:
@@ -1302,6 +1409,7 @@ def check_all_users_ads():
                             socketio.emit('ads_update', {
                                 'new_ads': new_ads,
                                 'deleted_ads': deleted_ads,
+                                'data_version': UserStats.current_version(user.id),
                                 'message': f'Found {len(new_ads)} new ads, {len(deleted_ads)} removed'
                             }, room=f'user_{user.id}')
                             
@@ -1311,7 +1419,7 @@ def check_all_users_ads():
                 except Exception as e:
                     logger.error(f"Error checking ads for user {user.id}: {e}")
                     
-            logger.info(f"Scheduled check complete. Total: {total_new_ads} new ads, {total_deleted_ads} deleted ads")
+            logger.info(f"Scheduled check complete for {users_checked} users. Total: {total_new_ads} new ads, {total_deleted_ads} deleted ads")
             
     except Exception as e:
         logger.error(f"Error in scheduled check: {e}")
@@ -1428,36 +1536,6 @@ def catch_all(path):
             "path_requested": path
         }), 404
 
-def cleanup_old_new_tags_on_startup():
-    """Clean up old NEW tags when the application starts"""
-    try:
-        with app.app_context():
-            from datetime import datetime, timedelta, timezone
-            from app.models import UserAd, db
-            
-            # Clear "NEW" tags from ads older than 6 hours
-            # Use timezone-naive comparison since database stores timezone-naive datetimes
-            six_hours_ago = datetime.utcnow() - timedelta(hours=6)
-            
-            updated_count = UserAd.query.filter(
-                UserAd.is_new == True,
-                UserAd.marked_new_at < six_hours_ago
-            ).update({'is_new': False})
-            
-            if updated_count > 0:
-                db.session.commit()
-                print(f"🧹 Cleaned up NEW tags from {updated_count} ads older than 6 hours on startup")
-            else:
-                print("✅ No old NEW tags to clean up")
-        
-    except Exception as e:
-        print(f"❌ Error cleaning up old NEW tags on startup: {e}")
-        try:
-            with app.app_context():
-                db.session.rollback()
-        except:
-            pass
-
 if __name__ == '__main__':
     # Get port and host from environment variables (Coolify compatibility)
     port = int(os.getenv('PORT', 5000))
@@ -1471,9 +1549,6 @@ if __name__ == '__main__':
     print(f"   Server: {'Gunicorn' if is_gunicorn else 'Flask Dev Server'}")
     print(f"   Host: {host}:{port}")
     
-    # Clean up old NEW tags on startup
-    cleanup_old_new_tags_on_startup()
-    
     # Start file monitoring for production (to detect scheduler updates)
     if is_production or is_gunicorn:
         print("🔍 Starting file monitoring for production...")
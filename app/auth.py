@@ -4,15 +4,24 @@ Handles user registration, login, password management, and session security
 """
 import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify, session, current_app
+from flask import g, request, jsonify, session, current_app
 from flask_login import current_user, login_user, logout_user
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, create_refresh_token, get_current_user
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from app.models import db, User, UserSession
+from app.db_writer import db_writer
+from app.maintenance import purge_expired_sessions
+from app.password_hasher import password_hasher
+from app.read_replica import RoutingSession
 import re
 import hashlib
 import logging
@@ -25,6 +34,81 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
+class UserSnapshot:
+    """Read-only copy of the User fields authenticated views need, safe to share between requests"""
+    
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.is_active = user.is_active
+        self.is_verified = user.is_verified
+    
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+class UserCache:
+    """In-process TTL + LRU cache of active users for require_auth"""
+    
+    def __init__(self, max_size=1024, ttl_seconds=60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # user_id -> (expires_at, snapshot)
+        self._lock = threading.Lock()
+    
+    def get(self, user_id):
+        """Cached snapshot of an active user, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+    
+    def put(self, user_id, snapshot):
+        """Cache a snapshot, evicting the least recently used user when full"""
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id):
+        """Drop a user, their next request reloads them from the database"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Active users seen by require_auth, staleness is bounded by the TTL
+user_cache = UserCache(
+    max_size=int(os.getenv('AUTH_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.getenv('AUTH_CACHE_TTL_SECONDS', 60))
+)
+
+@event.listens_for(User.is_active, 'set')
+@event.listens_for(User.password_hash, 'set')
+def invalidate_cached_user(user, value, old_value, initiator):
+    """Deactivation or a password change evicts the user now and again once it is committed"""
+    if user.id is None:
+        return
+    user_cache.invalidate(user.id)
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('invalidated_user_ids', set()).add(user.id)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def invalidate_committed_users(session):
+    """Evict again after commit, in case a concurrent request re-cached the old state meanwhile"""
+    for user_id in session.info.pop('invalidated_user_ids', ()):
+        user_cache.invalidate(user_id)
+
 class AuthService:
     """Service for handling authentication operations"""
     
@@ -88,15 +172,18 @@ class AuthService:
             if User.query.filter_by(email=email).first():
                 return False, "Email already registered"
             
+            # Hash before queueing, bcrypt must not hold up the writer
+            password_hash = password_hasher.hash(password)
+            
             # Create new user
-            user = User(
-                username=username,
-                email=email
-            )
-            user.set_password(password)
+            def _create_user():
+                db.session.add(User(
+                    username=username,
+                    email=email,
+                    password_hash=password_hash
+                ))
             
-            db.session.add(user)
-            db.session.commit()
+            db_writer.run(_create_user)
             
             logger.info(f"New user registered: {username}")
             return True, "User registered successfully"
@@ -125,9 +212,32 @@ class AuthService:
             if not user.check_password(password):
                 return False, "Invalid username/email or password", None
             
-            # Update last login
-            user.last_login = datetime.utcnow()
-            db.session.commit()
+            # Upgrade the hash while the plaintext is at hand if BCRYPT_ROUNDS changed
+            new_password_hash = password_hasher.hash(password) if user.password_needs_rehash() else None
+            
+            user_id = user.id
+            now = datetime.utcnow()
+            session_token = secrets.token_urlsafe(32)
+            ip_address = request.remote_addr
+            user_agent = request.headers.get('User-Agent', '')
+            
+            # Update last login and create the session record in one write
+            def _record_login():
+                user_row = db.session.get(User, user_id)
+                user_row.last_login = now
+                if new_password_hash:
+                    user_row.password_hash = new_password_hash
+                db.session.add(UserSession(
+                    user_id=user_id,
+                    session_token=session_token,
+                    ip_address=ip_address,
+                    user_agent=user_agent,
+                    expires_at=now + timedelta(days=30 if remember_me else 1)
+                ))
+            
+            db_writer.run(_record_login)
+            if new_password_hash:
+                logger.info(f"Rehashed password of {user.username} with cost {password_hasher.rounds}")
             
             # Create Flask-Login session
             login_user(user, remember=remember_me)
@@ -136,18 +246,6 @@ class AuthService:
             access_token = create_access_token(identity=str(user.id))
             refresh_token = create_refresh_token(identity=str(user.id))
             
-            # Create session record
-            session_token = secrets.token_urlsafe(32)
-            user_session = UserSession(
-                user_id=user.id,
-                session_token=session_token,
-                ip_address=request.remote_addr,
-                user_agent=request.headers.get('User-Agent', ''),
-                expires_at=datetime.utcnow() + timedelta(days=30 if remember_me else 1)
-            )
-            db.session.add(user_session)
-            db.session.commit()
-            
             logger.info(f"User logged in: {user.username}")
             return True, "Login successful", {
                 'user': user.to_dict(),
@@ -170,10 +268,7 @@ class AuthService:
             
             # Invalidate session if provided
             if session_token:
-                user_session = UserSession.query.filter_by(session_token=session_token).first()
-                if user_session:
-                    user_session.is_active = False
-                    db.session.commit()
+                db_writer.run(lambda: UserSession.query.filter_by(session_token=session_token).update({'is_active': False}))
             
             logger.info("User logged out")
             return True, "Logout successful"
@@ -191,21 +286,16 @@ class AuthService:
     
     @staticmethod
     def cleanup_expired_sessions():
-        """Clean up expired sessions"""
+        """Clean up expired and logged out sessions in batches, returns the PurgeResult"""
         try:
-            expired_sessions = UserSession.query.filter(
-                UserSession.expires_at < datetime.utcnow()
-            ).all()
-            
-            for session in expired_sessions:
-                db.session.delete(session)
-            
-            db.session.commit()
-            logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
+            result = purge_expired_sessions()
+            logger.info(f"Cleaned up {result.rows} expired sessions ({result.rows_per_second} rows/s)")
+            return result
             
         except Exception as e:
             db.session.rollback()
             logger.error(f"Session cleanup error: {str(e)}")
+            return None
 
 def require_auth(f):
     """Decorator to require JWT authentication"""
@@ -223,15 +313,17 @@ def require_auth(f):
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid user ID'}), 401
         
-        # Load the user object
-        from app.models import User
-        user = User.query.get(user_id)
-        if not user or not user.is_active:
-            return jsonify({'error': 'User account not found or inactive'}), 401
+        # Serve active users from the cache, only a miss hits the database
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            user = db.session.get(User, user_id)
+            if not user or not user.is_active:
+                return jsonify({'error': 'User account not found or inactive'}), 401
+            snapshot = UserSnapshot(user)
+            user_cache.put(user_id, snapshot)
             
-        # Store current user in flask.g for access in the view
-        from flask import g
-        g.current_user = user
+        # Store current user in flask.g for access in the view (load the full User via db.session.get to modify it)
+        g.current_user = snapshot
         
         return f(*args, **kwargs)
     return decorated_function
@@ -0,0 +1,48 @@
+"""
+Conditional GETs for BazosChecker user endpoints
+Every user has a data version (UserStats.data_version) bumped with each change to
+their keywords, ads or favorites. GET endpoints send it as an ETag and answer a
+matching If-None-Match with 304 Not Modified before running any of their queries.
+"""
+import os
+import time
+from functools import wraps
+from flask import g, make_response, request
+from app.models import UserStats
+
+# The NEW tag and last check times move with the clock, not the data version -
+# ETags also roll over every bucket so those are never stale for longer
+ETAG_TIME_BUCKET_SECONDS = int(os.getenv('ETAG_TIME_BUCKET_SECONDS', 60))
+
+def data_etag(user_id, version):
+    """ETag for a user's data at a version, unique per user so shared browsers never mix accounts"""
+    return f'{user_id}-{version}-{int(time.time() // ETAG_TIME_BUCKET_SECONDS)}'
+
+def etag_by_data_version(f):
+    """Decorator answering GETs with 304 Not Modified while the user's data version is unchanged
+
+    Place it below @require_auth and @read_from_replica, so the version is read from
+    the same database as the data.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return f(*args, **kwargs)
+
+        # Read before the view runs: a concurrent change can only make the ETag older than the body
+        version = UserStats.current_version(g.current_user.id)
+        etag = data_etag(g.current_user.id, version)
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        response.headers['X-Data-Version'] = str(version)
+        # Browsers keep the body but revalidate on every request
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Authorization')
+        return response
+    return decorated_function
@@ -0,0 +1,126 @@
+"""
+Single-writer queue for BazosChecker
+On SQLite only one connection can write at a time, so every write operation in this
+process is funnelled through one dedicated thread. Queued operations are applied in
+batches with a single commit, and readers (WAL mode) never wait behind them.
+On other databases operations simply run inline in the caller's session.
+Deliberately not routed through the writer: run_migrations, which runs once at
+startup before any request and needs connections of its own for DDL, and the
+standalone init_db.py script, which runs outside the app process.
+"""
+import os
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+class DatabaseWriter:
+    """Serializes write operations onto a dedicated writer thread"""
+
+    def __init__(self, app=None, max_batch=None):
+        self.app = None
+        self.enabled = False
+        self.max_batch = max_batch or int(os.getenv('DB_WRITER_MAX_BATCH', 50))
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the writer to an app, the queue is only used for SQLite databases"""
+        self.app = app
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        self.enabled = uri.startswith('sqlite') and os.getenv('DB_WRITER_ENABLED', 'true').lower() == 'true'
+
+    def _ensure_started(self):
+        """Start the writer thread on first use (also after a fork, where threads do not survive)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+                logger.info(f"Database writer thread started (max batch: {self.max_batch})")
+
+    def submit(self, operation):
+        """Queue operation() for the writer thread and return a Future with its result
+
+        The operation runs in the writer's own session and must not touch ORM objects
+        loaded by the caller. It must not commit, the writer commits for it.
+        It must be safe to run more than once: when its batch fails, the batch is
+        rolled back and every operation runs again in a transaction of its own.
+        Build rows in locals instead of mutating state captured from the caller.
+        """
+        future = Future()
+        if not self.enabled:
+            future.set_result(self._run_inline(operation))
+            return future
+
+        self._ensure_started()
+        self._queue.put((operation, future))
+        return future
+
+    def run(self, operation, timeout=60):
+        """Run operation() as a write and wait for its result"""
+        if not self.enabled or threading.current_thread() is self._thread:
+            return self._run_inline(operation)
+        result = self.submit(operation).result(timeout=timeout)
+        # The caller's session may hold objects the writer just changed
+        db.session.expire_all()
+        return result
+
+    def _run_inline(self, operation):
+        """Run operation() in the current session and commit"""
+        try:
+            result = operation()
+            db.session.commit()
+            return result
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _run(self):
+        """Writer loop: drain up to max_batch operations and commit them together"""
+        with self.app.app_context():
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                try:
+                    self._apply_batch(batch)
+                except Exception as e:
+                    logger.error(f"Database writer batch failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def _apply_batch(self, batch):
+        """Apply a batch in one transaction, falling back to one transaction per operation on failure"""
+        try:
+            results = [operation() for operation, _ in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Isolate the failing operation so the rest of the batch still lands
+            for operation, future in batch:
+                try:
+                    future.set_result(self._run_inline(operation))
+                except Exception as op_error:
+                    future.set_exception(op_error)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+# Process-wide writer, bound to the Flask app at startup
+db_writer = DatabaseWriter()
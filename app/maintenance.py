@@ -0,0 +1,191 @@
+"""
+Batched maintenance jobs for BazosChecker
+Large purges and archive moves run as bounded set-based statements, one db_writer
+write per batch with a pause in between, so no single transaction holds locks for long.
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, exists, func, insert, or_, select, text
+from app.db_writer import db_writer
+from app.models import db, UserAd, UserAdKeyword, ArchivedUserAd, UserFavorite, UserStats, UserSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_PAUSE = 0.2  # seconds between batches
+
+# Deleted ads move to the archive after this many days and are dropped from it after the retention
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 7))
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 365))
+
+# Columns copied verbatim from user_ads into archived_user_ads
+ARCHIVED_COLUMNS = (
+    'id', 'user_id', 'keyword_id', 'listing_id', 'ad_id', 'date_added_parsed',
+    'scraped_at', 'is_new', 'marked_new_at', 'is_deleted', 'deleted_at'
+)
+
+class PurgeResult:
+    """Outcome of a batched purge"""
+
+    def __init__(self, rows, batches, duration_s):
+        self.rows = rows
+        self.batches = batches
+        self.duration_s = duration_s
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.duration_s, 1) if self.duration_s > 0 else float(self.rows)
+
+    def __repr__(self):
+        return f'<PurgeResult {self.rows} rows in {self.batches} batches, {self.rows_per_second} rows/s>'
+
+def run_in_batches(select_ids, delete_ids, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE):
+    """Repeatedly select up to batch_size ids and delete them, one db_writer write per batch
+
+    select_ids(limit) returns a list of primary keys, delete_ids(ids) issues the DELETEs.
+    Both run inside the write, so a rerun of a failed batch selects its ids afresh.
+    """
+    rows = 0
+    batches = 0
+    start_time = time.time()
+
+    def _batch():
+        ids = select_ids(batch_size)
+        if ids:
+            delete_ids(ids)
+        return len(ids)
+
+    while True:
+        count = db_writer.run(_batch)
+        if not count:
+            break
+
+        rows += count
+        batches += 1
+        if count < batch_size:
+            break
+
+        # Let other writers in before taking the next batch
+        time.sleep(pause)
+
+    return PurgeResult(rows, batches, time.time() - start_time)
+
+def purge_deleted_ads(older_than_days=30, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE):
+    """Permanently remove ads that have been deleted for more than older_than_days"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    def _select_ids(limit):
+        return list(db.session.scalars(
+            select(UserAd.id)
+            .where(UserAd.is_deleted == True, UserAd.deleted_at < cutoff)
+            .limit(limit)
+        ))
+
+    def _delete_ids(ids):
+        removed_favorites = db.session.execute(
+            select(UserFavorite.user_id, func.count(UserFavorite.id))
+            .where(UserFavorite.ad_id.in_(ids))
+            .group_by(UserFavorite.user_id)
+        ).all()
+
+        UserStats.bump_versions(select(UserAd.user_id).where(UserAd.id.in_(ids)).distinct().scalar_subquery())
+
+        # Remove associated favorites and keyword links first (to maintain foreign key integrity)
+        db.session.execute(delete(UserFavorite).where(UserFavorite.ad_id.in_(ids)))
+        db.session.execute(delete(UserAdKeyword).where(UserAdKeyword.user_ad_id.in_(ids)))
+        db.session.execute(delete(UserAd).where(UserAd.id.in_(ids)))
+
+        for user_id, count in removed_favorites:
+            UserStats.adjust_counters(user_id, favorites=-count)
+
+    return run_in_batches(_select_ids, _delete_ids, batch_size, pause)
+
+def archive_deleted_ads(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE):
+    """Move ads deleted for more than older_than_days from user_ads into archived_user_ads
+
+    Favorited ads stay in the hot table so favorites keep pointing at them.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    def _select_ids(limit):
+        return list(db.session.scalars(
+            select(UserAd.id)
+            .where(
+                UserAd.is_deleted == True,
+                UserAd.deleted_at < cutoff,
+                ~exists().where(UserFavorite.ad_id == UserAd.id)
+            )
+            .limit(limit)
+        ))
+
+    def _move_ids(ids):
+        archived_at = datetime.utcnow()
+        UserStats.bump_versions(select(UserAd.user_id).where(UserAd.id.in_(ids)).distinct().scalar_subquery())
+        columns = [getattr(UserAd, name) for name in ARCHIVED_COLUMNS]
+        db.session.execute(
+            insert(ArchivedUserAd).from_select(
+                list(ARCHIVED_COLUMNS) + ['archived_at'],
+                select(*columns, db.literal(archived_at)).where(UserAd.id.in_(ids))
+            )
+        )
+        db.session.execute(delete(UserAdKeyword).where(UserAdKeyword.user_ad_id.in_(ids)))
+        db.session.execute(delete(UserAd).where(UserAd.id.in_(ids)))
+
+    return run_in_batches(_select_ids, _move_ids, batch_size, pause)
+
+def purge_archived_ads(older_than_days=ARCHIVE_RETENTION_DAYS, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE):
+    """Drop archived ads once they are past the archive retention"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    def _select_ids(limit):
+        return list(db.session.scalars(
+            select(ArchivedUserAd.id).where(ArchivedUserAd.deleted_at < cutoff).limit(limit)
+        ))
+
+    def _delete_ids(ids):
+        UserStats.bump_versions(select(ArchivedUserAd.user_id).where(ArchivedUserAd.id.in_(ids)).distinct().scalar_subquery())
+        db.session.execute(delete(ArchivedUserAd).where(ArchivedUserAd.id.in_(ids)))
+
+    return run_in_batches(_select_ids, _delete_ids, batch_size, pause)
+
+def purge_expired_sessions(batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE):
+    """Drop login sessions that have expired or were ended by a logout"""
+    now = datetime.utcnow()
+
+    def _select_ids(limit):
+        return list(db.session.scalars(
+            select(UserSession.id)
+            .where(or_(UserSession.expires_at < now, UserSession.is_active == False))
+            .limit(limit)
+        ))
+
+    def _delete_ids(ids):
+        db.session.execute(delete(UserSession).where(UserSession.id.in_(ids)))
+
+    return run_in_batches(_select_ids, _delete_ids, batch_size, pause)
+
+def table_stats(table_name):
+    """(row count, size in bytes) of a table, the size is None where the database cannot report it"""
+    rows = db.session.execute(text(f'SELECT COUNT(*) FROM {table_name}')).scalar()
+
+    size_bytes = None
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            size_bytes = db.session.execute(
+                text('SELECT pg_total_relation_size(CAST(:table_name AS regclass))'), {'table_name': table_name}
+            ).scalar()
+        elif dialect == 'sqlite':
+            # dbstat is optional in SQLite builds, counts the table and its indexes
+            size_bytes = db.session.execute(
+                text('SELECT SUM(pgsize) FROM dbstat WHERE name = :table_name OR name IN '
+                     '(SELECT name FROM sqlite_master WHERE type = \'index\' AND tbl_name = :table_name)'),
+                {'table_name': table_name}
+            ).scalar()
+    except Exception as e:
+        db.session.rollback()
+        logger.debug(f"Table size of {table_name} unavailable: {e}")
+
+    return rows, size_bytes
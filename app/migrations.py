@@ -0,0 +1,414 @@
+"""
+Schema upgrades for BazosChecker
+db.create_all() only creates missing tables, so changes to existing tables are applied here.
+Every upgrade is idempotent and safe to run on each startup.
+On SQLite an ALTER TABLE commits on its own, so backfills are conditioned on the rows still
+needing them rather than on the column being new - a crash between the two is repaired on
+the next start.
+"""
+import logging
+from sqlalchemy import func, insert, inspect, or_, select, text, union_all, update
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import OperationalError
+from app.models import db, ArchivedUserAd, Listing, UserAd, UserAdKeyword, UserFavorite, UserKeyword, UserStats
+from app.search import FTS_TABLE, listing_search_text
+
+logger = logging.getLogger(__name__)
+
+def _column_names(table_name):
+    """Get the column names of an existing table"""
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+def _add_missing_columns(table_name, columns):
+    """ALTER TABLE ADD COLUMN for each (name, type) the table lacks, returns whether any was added
+
+    Each column is checked on its own, as a crash can leave only some of them added.
+    """
+    existing = _column_names(table_name)
+    added = []
+    for name, column_type in columns:
+        if name not in existing:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name} {column_type}'))
+            added.append(name)
+
+    if added:
+        logger.info(f"Added {table_name} columns: {', '.join(added)}")
+    return bool(added)
+
+def upgrade_listings():
+    """Move ad content out of user_ads into the shared listings table"""
+    columns = _column_names('user_ads')
+    changed = False
+    if 'listing_id' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE user_ads ADD COLUMN listing_id INTEGER REFERENCES listings(id)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_ads_listing_id ON user_ads (listing_id)'))
+        changed = True
+
+    with db.engine.begin() as conn:
+        if conn.execute(text('SELECT 1 FROM user_ads WHERE listing_id IS NULL LIMIT 1')).first() is None:
+            return changed
+
+        # Legacy rows carry their own copy of the content - keep the newest copy per ad
+        if 'title' in columns:
+            conn.execute(text('''
+                INSERT INTO listings (ad_id, title, description, price, location, seller_name,
+                                      link, image_url, date_added, date_added_parsed, created_at, updated_at)
+                SELECT ad_id, title, description, price, location, seller_name,
+                       link, image_url, date_added, date_added_parsed, scraped_at, scraped_at
+                FROM user_ads
+                WHERE id IN (SELECT MAX(id) FROM user_ads GROUP BY ad_id)
+                  AND ad_id NOT IN (SELECT ad_id FROM listings)
+            '''))
+
+        linked = conn.execute(text('''
+            UPDATE user_ads
+            SET listing_id = (SELECT listings.id FROM listings WHERE listings.ad_id = user_ads.ad_id)
+            WHERE listing_id IS NULL AND EXISTS (SELECT 1 FROM listings WHERE listings.ad_id = user_ads.ad_id)
+        ''')).rowcount
+
+    if linked:
+        logger.info(f"Migrated {linked} user_ads into the listings table")
+    return changed or bool(linked)
+
+def upgrade_deleted_at():
+    """Add user_ads.deleted_at, backfilled from scraped_at for deleted ads that have none"""
+    changed = False
+    if 'deleted_at' not in _column_names('user_ads'):
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE user_ads ADD COLUMN deleted_at TIMESTAMP'))
+        logger.info("Added user_ads.deleted_at")
+        changed = True
+
+    with db.engine.begin() as conn:
+        # The real deletion time was never recorded - fall back to scraped_at, which the purge used to age rows by
+        filled = conn.execute(
+            text('''
+                UPDATE user_ads SET deleted_at = COALESCE(scraped_at, CURRENT_TIMESTAMP)
+                WHERE is_deleted = :deleted AND deleted_at IS NULL
+            '''),
+            {'deleted': True}
+        ).rowcount
+
+    if filled:
+        logger.info(f"Backfilled deleted_at of {filled} deleted ads")
+    return changed or bool(filled)
+
+def upgrade_search_text(batch_size=500):
+    """Add listings.search_text and fill it for listings stored before search existed"""
+    changed = False
+    if 'search_text' not in _column_names('listings'):
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE listings ADD COLUMN search_text TEXT'))
+        changed = True
+
+    # Folding happens in Python, so the backfill reads and writes in batches
+    filled = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                text('SELECT id, title, description FROM listings WHERE search_text IS NULL LIMIT :limit'),
+                {'limit': batch_size}
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                text('UPDATE listings SET search_text = :search_text WHERE id = :id'),
+                [{'id': row.id, 'search_text': listing_search_text(row.title, row.description)} for row in rows]
+            )
+        filled += len(rows)
+
+    if filled:
+        logger.info(f"Filled search text for {filled} listings")
+    return changed or bool(filled)
+
+def upgrade_keyword_canonical():
+    """Add user_keywords.canonical and bring it in line with the current canonicalization
+
+    Keywords are few, so every row is recomputed - this also picks up a changed
+    KEYWORD_FOLD_DIACRITICS setting.
+    """
+    changed = False
+    if 'canonical' not in _column_names('user_keywords'):
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE user_keywords ADD COLUMN canonical VARCHAR(200)'))
+        changed = True
+
+    with db.engine.begin() as conn:
+        rows = conn.execute(text('SELECT id, keyword, canonical FROM user_keywords')).fetchall()
+        stale = [
+            {'id': row.id, 'canonical': UserKeyword.canonicalize(row.keyword)}
+            for row in rows
+            if row.canonical != UserKeyword.canonicalize(row.keyword)
+        ]
+        if stale:
+            conn.execute(text('UPDATE user_keywords SET canonical = :canonical WHERE id = :id'), stale)
+
+    if stale:
+        logger.info(f"Canonicalized {len(stale)} keywords")
+    return changed or bool(stale)
+
+def upgrade_listing_prices(batch_size=500):
+    """Add parsed price columns to listings, seeding price_history with the current prices"""
+    changed = _add_missing_columns('listings', (
+        ('price_value', 'INTEGER'),
+        ('previous_price_value', 'INTEGER'),
+        ('price_changed_at', 'TIMESTAMP'),
+    ))
+
+    # Parsing happens in Python, walk the unparsed listings in id order (prices like "Dohodou" stay NULL)
+    filled = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                text('''
+                    SELECT id, price, updated_at FROM listings
+                    WHERE price_value IS NULL AND id > :last_id ORDER BY id LIMIT :limit
+                '''),
+                {'last_id': last_id, 'limit': batch_size}
+            ).fetchall()
+            if not rows:
+                break
+            priced = [
+                {'id': row.id, 'price': row.price, 'price_value': Listing.parse_price(row.price), 'recorded_at': row.updated_at}
+                for row in rows
+                if Listing.parse_price(row.price) is not None
+            ]
+            if priced:
+                conn.execute(text('UPDATE listings SET price_value = :price_value WHERE id = :id'), priced)
+                conn.execute(text('''
+                    INSERT INTO price_history (listing_id, price, price_value, recorded_at)
+                    VALUES (:id, :price, :price_value, :recorded_at)
+                '''), priced)
+        filled += len(priced)
+        last_id = rows[-1].id
+
+    if filled:
+        logger.info(f"Parsed prices of {filled} listings")
+    return changed or bool(filled)
+
+def upgrade_listing_lifecycle():
+    """Add the listing lifecycle columns and backfill them from what older schemas recorded"""
+    changed = _add_missing_columns('listings', (
+        ('first_seen_at', 'TIMESTAMP'),
+        ('last_seen_at', 'TIMESTAMP'),
+        ('seen_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('deleted_at', 'TIMESTAMP'),
+    ))
+
+    # New listings always get first_seen_at, so only listings from before the columns existed are NULL
+    with db.engine.begin() as conn:
+        # Listings every user has lost track of went missing at their last user_ads deletion
+        conn.execute(text('''
+            UPDATE listings
+            SET deleted_at = (SELECT MAX(user_ads.deleted_at) FROM user_ads WHERE user_ads.listing_id = listings.id)
+            WHERE first_seen_at IS NULL AND NOT EXISTS (
+                SELECT 1 FROM user_ads WHERE user_ads.listing_id = listings.id AND user_ads.is_deleted = :deleted
+            )
+        '''), {'deleted': False})
+        # Sightings were never counted - the insert and the last refresh are the known ones
+        filled = conn.execute(text('''
+            UPDATE listings
+            SET first_seen_at = COALESCE(created_at, updated_at, CURRENT_TIMESTAMP),
+                last_seen_at = COALESCE(updated_at, created_at, CURRENT_TIMESTAMP),
+                seen_count = 1
+            WHERE first_seen_at IS NULL
+        ''')).rowcount
+
+    if filled:
+        logger.info(f"Backfilled lifecycle of {filled} listings")
+    return changed or bool(filled)
+
+def upgrade_stats_counters():
+    """Add the live counters to user_stats, initialised from a recount of every user
+
+    The columns are added without a default, so rows an interrupted upgrade left
+    uncounted are still NULL and get recounted on the next start.
+    """
+    counters = ('active_keywords_count', 'active_ads_count', 'favorites_count')
+    changed = _add_missing_columns('user_stats', [(counter, 'INTEGER') for counter in counters])
+
+    with db.engine.begin() as conn:
+        keywords_count, ads_count, favorites_count = UserStats.counter_subqueries(UserStats.user_id)
+        recounted = conn.execute(
+            update(UserStats)
+            .where(or_(*(getattr(UserStats, counter).is_(None) for counter in counters)))
+            .values(
+                active_keywords_count=keywords_count,
+                active_ads_count=ads_count,
+                favorites_count=favorites_count
+            )
+        ).rowcount
+
+    if recounted:
+        logger.info(f"Initialised live counters of {recounted} users")
+    return changed or bool(recounted)
+
+def upgrade_data_version():
+    """Add user_stats.data_version, every user starts at version 0"""
+    if 'data_version' in _column_names('user_stats'):
+        return False
+
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE user_stats ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0'))
+
+    logger.info("Added user_stats.data_version")
+    return True
+
+def upgrade_ad_keywords():
+    """Link every live ad to the keyword that found it, for databases predating user_ad_keywords"""
+    with db.engine.begin() as conn:
+        if conn.execute(select(UserAdKeyword.user_ad_id).limit(1)).first() is not None:
+            return False
+
+        linked = conn.execute(
+            insert(UserAdKeyword).from_select(
+                ['user_ad_id', 'keyword_id', 'created_at'],
+                select(UserAd.id, UserAd.keyword_id, UserAd.scraped_at).where(UserAd.is_deleted == False)
+            )
+        ).rowcount
+
+    if linked:
+        logger.info(f"Linked {linked} ads to their keywords")
+    return bool(linked)
+
+def _rebuild_user_ads(conn):
+    """Recreate user_ads from the model (AUTOINCREMENT included), keeping rows and ids
+
+    Indexes go with the old table, create_missing_indexes puts them back.
+    """
+    old_columns = {column['name'] for column in inspect(conn).get_columns('user_ads')}
+    columns = ', '.join(column.name for column in UserAd.__table__.columns if column.name in old_columns)
+    table_sql = str(CreateTable(UserAd.__table__).compile(conn)).replace('CREATE TABLE user_ads ', 'CREATE TABLE user_ads_rebuild ', 1)
+
+    conn.execute(text('DROP TABLE IF EXISTS user_ads_rebuild'))
+    conn.execute(text(table_sql))
+    conn.execute(text(f'INSERT INTO user_ads_rebuild ({columns}) SELECT {columns} FROM user_ads'))
+    conn.execute(text('DROP TABLE user_ads'))
+    conn.execute(text('ALTER TABLE user_ads_rebuild RENAME TO user_ads'))
+
+def upgrade_user_ads_autoincrement():
+    """Stop SQLite from handing out user_ads ids that archived_user_ads already holds
+
+    A plain INTEGER PRIMARY KEY reuses max(id) + 1 once the newest ads were archived. Rebuilds
+    user_ads with AUTOINCREMENT, renumbers live ads already sharing an id with an archived one
+    and starts the id sequence above both tables.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        # PostgreSQL sequences never hand out an id twice
+        return False
+
+    changed = False
+    with db.engine.begin() as conn:
+        table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user_ads'")).scalar()
+        if 'AUTOINCREMENT' not in table_sql.upper():
+            _rebuild_user_ads(conn)
+            changed = True
+            logger.info("Rebuilt user_ads with AUTOINCREMENT ids")
+
+        top_ids = union_all(select(func.max(UserAd.id).label('id')), select(func.max(ArchivedUserAd.id))).subquery()
+        top_id = conn.execute(select(func.max(top_ids.c.id))).scalar() or 0
+
+        collisions = conn.scalars(select(UserAd.id).where(UserAd.id.in_(select(ArchivedUserAd.id)))).all()
+        for old_id in collisions:
+            top_id += 1
+            conn.execute(update(UserAd).where(UserAd.id == old_id).values(id=top_id))
+            conn.execute(update(UserFavorite).where(UserFavorite.ad_id == old_id).values(ad_id=top_id))
+            conn.execute(update(UserAdKeyword).where(UserAdKeyword.user_ad_id == old_id).values(user_ad_id=top_id))
+        if collisions:
+            logger.info(f"Renumbered {len(collisions)} ads whose id was already archived")
+
+        sequence = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'user_ads'")).scalar()
+        if top_id > (sequence or 0):
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'user_ads'"))
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('user_ads', :seq)"), {'seq': top_id})
+            changed = True
+
+    return changed or bool(collisions)
+
+def upgrade_sqlite_fts():
+    """Create the SQLite FTS5 index over listings.search_text, kept in sync by triggers"""
+    if db.engine.dialect.name != 'sqlite' or FTS_TABLE in inspect(db.engine).get_table_names():
+        return False
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(search_text, content='listings', content_rowid='id')"))
+            conn.execute(text(f'''
+                CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON listings BEGIN
+                    INSERT INTO {FTS_TABLE} (rowid, search_text) VALUES (new.id, new.search_text);
+                END
+            '''))
+            conn.execute(text(f'''
+                CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON listings BEGIN
+                    INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+                END
+            '''))
+            conn.execute(text(f'''
+                CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF search_text ON listings BEGIN
+                    INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+                    INSERT INTO {FTS_TABLE} (rowid, search_text) VALUES (new.id, new.search_text);
+                END
+            '''))
+            # Index the listings that already exist
+            conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError as e:
+        logger.warning(f"SQLite FTS5 unavailable, ad search falls back to LIKE: {e}")
+        return False
+
+    logger.info(f"Created {FTS_TABLE} full-text index")
+    return True
+
+def create_missing_indexes():
+    """Create indexes declared on the models that existing tables are missing"""
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect.name
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            # Skip dialect-specific indexes (e.g. PostgreSQL partial indexes) on other databases
+            ddl_if = getattr(index, '_ddl_if', None)
+            if ddl_if is not None and ddl_if.dialect and ddl_if.dialect != dialect:
+                continue
+            index.create(bind=db.engine, checkfirst=True)
+            created.append(index.name)
+
+    if created:
+        logger.info(f"Created missing indexes: {', '.join(created)}")
+    return bool(created)
+
+MIGRATIONS = [
+    upgrade_listings,
+    upgrade_deleted_at,
+    upgrade_search_text,
+    upgrade_keyword_canonical,
+    upgrade_listing_prices,
+    upgrade_listing_lifecycle,
+    upgrade_stats_counters,
+    upgrade_data_version,
+    upgrade_ad_keywords,
+    upgrade_user_ads_autoincrement,
+    upgrade_sqlite_fts,
+    create_missing_indexes,
+]
+
+def run_migrations():
+    """Apply all pending schema upgrades, must run after db.create_all()"""
+    applied = 0
+    for migration in MIGRATIONS:
+        try:
+            if migration():
+                applied += 1
+        except Exception as e:
+            logger.error(f"Schema upgrade {migration.__name__} failed: {e}")
+            raise
+    return applied
@@ -3,15 +3,44 @@ Database models for BazosChecker user system
 """
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from flask_bcrypt import Bcrypt
-from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import validates
+from datetime import datetime, timedelta
 import json
 import logging
+import os
+import re
+import sqlite3
+from app.read_replica import RoutingSession
+from app.password_hasher import password_hasher
 
-db = SQLAlchemy()
-bcrypt = Bcrypt()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 logger = logging.getLogger(__name__)
 
+# How long a freshly found ad keeps its "NEW" tag, derived at read time from marked_new_at
+NEW_AD_WINDOW = timedelta(hours=float(os.getenv('NEW_AD_WINDOW_HOURS', 6)))
+
+# Whether keywords differing only in diacritics ("kůň" / "kun") share one search
+KEYWORD_FOLD_DIACRITICS = os.getenv('KEYWORD_FOLD_DIACRITICS', 'false').lower() == 'true'
+
+# How long a SQLite connection waits for the write lock before giving up
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 20000))
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL journal so readers never block behind the writer (and vice versa)"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints, safe against corruption in WAL mode
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute('PRAGMA cache_size=-20000')  # ~20 MB page cache
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
 class User(UserMixin, db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
@@ -32,19 +61,33 @@ class User(UserMixin, db.Model):
     stats = db.relationship('UserStats', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """Hash and set password"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Hash and set password (bcrypt runs on the password hashing pool)"""
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
         """Check if provided password matches hash"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Whether the hash was made with a different cost than BCRYPT_ROUNDS"""
+        return password_hasher.needs_rehash(self.password_hash)
     
     def get_id(self):
         """Required for Flask-Login"""
         return str(self.id)
     
+    def get_counts(self):
+        """Count keywords, ads and favorites in one aggregate query without loading the rows"""
+        keywords_count, ads_count, favorites_count = db.session.query(
+            db.select(db.func.count(UserKeyword.id)).where(UserKeyword.user_id == self.id).scalar_subquery(),
+            db.select(db.func.count(UserAd.id)).where(UserAd.user_id == self.id).scalar_subquery(),
+            db.select(db.func.count(UserFavorite.id)).where(UserFavorite.user_id == self.id).scalar_subquery()
+        ).one()
+        return keywords_count, ads_count, favorites_count
+    
     def to_dict(self):
         """Convert user to dictionary for JSON responses"""
+        keywords_count, ads_count, favorites_count = self.get_counts()
         return {
             'id': self.id,
             'username': self.username,
@@ -53,9 +96,9 @@ class User(UserMixin, db.Model):
             'is_verified': self.is_verified,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None,
-            'keywords_count': len(self.keywords),
-            'ads_count': len(self.ads),
-            'favorites_count': len(self.favorites)
+            'keywords_count': keywords_count,
+            'ads_count': ads_count,
+            'favorites_count': favorites_count
         }
     
     def __repr__(self):
@@ -67,7 +110,8 @@ class UserKeyword(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    keyword = db.Column(db.String(200), nullable=False)
+    keyword = db.Column(db.String(200), nullable=False)  # As the user typed it, for display
+    canonical = db.Column(db.String(200), index=True)  # Search and scrape cache key, see canonicalize()
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_checked = db.Column(db.DateTime)
@@ -75,6 +119,23 @@ class UserKeyword(db.Model):
     # Unique constraint per user
     __table_args__ = (db.UniqueConstraint('user_id', 'keyword', name='unique_user_keyword'),)
     
+    @staticmethod
+    def canonicalize(keyword):
+        """Canonical search form: lowercased, whitespace collapsed, optionally without diacritics
+        
+        "CDJ 2000", "cdj  2000 " and "cdj 2000" all become "cdj 2000".
+        """
+        canonical = ' '.join((keyword or '').split()).lower()
+        if KEYWORD_FOLD_DIACRITICS:
+            from app.search import fold_text
+            canonical = fold_text(canonical)
+        return canonical
+    
+    @validates('keyword')
+    def _update_canonical(self, key, keyword):
+        self.canonical = UserKeyword.canonicalize(keyword)
+        return keyword
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -87,16 +148,14 @@ class UserKeyword(db.Model):
     def __repr__(self):
         return f'<UserKeyword {self.keyword} for User {self.user_id}>'
 
-class UserAd(db.Model):
-    """Ads found for users"""
-    __tablename__ = 'user_ads'
+class Listing(db.Model):
+    """Bazos ad content, stored once and shared by every user tracking it"""
+    __tablename__ = 'listings'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    keyword_id = db.Column(db.Integer, db.ForeignKey('user_keywords.id'), nullable=False, index=True)
+    ad_id = db.Column(db.String(100), unique=True, nullable=False, index=True)  # Original ad ID from Bazos
     
     # Ad data
-    ad_id = db.Column(db.String(100), nullable=False)  # Original ad ID from Bazos
     title = db.Column(db.Text)
     description = db.Column(db.Text)
     price = db.Column(db.String(100))
@@ -108,16 +167,124 @@ class UserAd(db.Model):
     # Metadata
     date_added = db.Column(db.String(100))  # Date from Bazos (original format)
     date_added_parsed = db.Column(db.DateTime)  # Parsed date for sorting
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Parsed price in CZK, None for prices like "Dohodou"; the previous one is kept for drop flags
+    price_value = db.Column(db.Integer)
+    previous_price_value = db.Column(db.Integer)
+    price_changed_at = db.Column(db.DateTime)
+    
+    # Diacritics-folded title and description for full-text search (see app/search.py)
+    search_text = db.Column(db.Text)
+    
+    # Lifecycle on Bazos as observed by the checks, time on market is deleted_at - first_seen_at
+    first_seen_at = db.Column(db.DateTime)
+    last_seen_at = db.Column(db.DateTime)
+    seen_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Distinct scrapes that found it
+    deleted_at = db.Column(db.DateTime)  # When it went missing from search results, cleared if seen again
+    
+    __table_args__ = (
+        # PostgreSQL full-text search; SQLite uses the listings_fts FTS5 table instead
+        db.Index(
+            'ix_listings_search',
+            db.func.to_tsvector(db.literal_column("'simple'"), search_text),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+    )
+    
+    @property
+    def price_dropped(self):
+        """Whether the last observed price change was a drop"""
+        return (
+            self.price_value is not None and self.previous_price_value is not None
+            and self.price_value < self.previous_price_value
+        )
+    
+    @staticmethod
+    def parse_price(price_str):
+        """Parse a Bazos price like '12 500 Kč' to an integer, None when there is no amount"""
+        if not price_str:
+            return None
+        digits = re.sub(r'\D', '', price_str.split(',')[0])
+        return int(digits) if digits else None
+    
+    def __repr__(self):
+        return f'<Listing {self.ad_id}>'
+
+class PriceHistory(db.Model):
+    """Observed prices of a listing, a row is only written when the parsed price changes"""
+    __tablename__ = 'price_history'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listings.id'), nullable=False)
+    price = db.Column(db.String(100))  # Price as shown on Bazos
+    price_value = db.Column(db.Integer)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Timeline: WHERE listing_id ORDER BY recorded_at
+        db.Index('ix_price_history_listing', 'listing_id', 'recorded_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'price': self.price,
+            'price_value': self.price_value,
+            'recorded_at': self.recorded_at.isoformat() if self.recorded_at else None
+        }
+    
+    def __repr__(self):
+        return f'<PriceHistory {self.price_value} for Listing {self.listing_id}>'
+
+class UserAd(db.Model):
+    """A user's subscription to a listing through one or more of their keywords"""
+    __tablename__ = 'user_ads'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    keyword_id = db.Column(db.Integer, db.ForeignKey('user_keywords.id'), nullable=False, index=True)  # Keyword the ad is shown under
+    listing_id = db.Column(db.Integer, db.ForeignKey('listings.id'), index=True)
+    ad_id = db.Column(db.String(100), nullable=False)  # Bazos ad ID, kept for per-user lookups
+    
+    # Metadata
+    date_added_parsed = db.Column(db.DateTime)  # Copied from the listing so feed ordering stays on this table
     scraped_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_new = db.Column(db.Boolean, default=True)
     marked_new_at = db.Column(db.DateTime, default=datetime.utcnow)  # When ad was marked as new
     is_deleted = db.Column(db.Boolean, default=False)
+    deleted_at = db.Column(db.DateTime)  # When the ad disappeared from Bazos, drives the purge
     
     # Relationships
     keyword = db.relationship('UserKeyword', backref='ads')
+    listing = db.relationship('Listing')
+    keyword_links = db.relationship('UserAdKeyword', lazy=True, cascade='all, delete-orphan')
     
-    # Unique constraint per user and ad
-    __table_args__ = (db.UniqueConstraint('user_id', 'ad_id', name='unique_user_ad'),)
+    # Unique constraint per user and ad, plus indexes matching the hot query shapes
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'ad_id', name='unique_user_ad'),
+        # Feed: WHERE user_id AND is_deleted ORDER BY date_added_parsed, scraped_at, id
+        db.Index('ix_user_ads_feed', 'user_id', 'is_deleted', 'date_added_parsed', 'scraped_at', 'id'),
+        # Per-keyword diff: WHERE user_id AND keyword_id AND is_deleted
+        db.Index('ix_user_ads_user_keyword', 'user_id', 'keyword_id', 'is_deleted'),
+        # NEW derivation: WHERE is_new AND marked_new_at >= cutoff
+        db.Index('ix_user_ads_new_marked', 'is_new', 'marked_new_at'),
+        # Deleted ads purge: WHERE is_deleted AND deleted_at < cutoff
+        db.Index('ix_user_ads_deleted_at', 'is_deleted', 'deleted_at'),
+        # PostgreSQL partial indexes covering only the rows those queries can match
+        db.Index(
+            'ix_user_ads_active_feed',
+            user_id, date_added_parsed.desc().nulls_last(), scraped_at.desc(), id.desc(),
+            postgresql_where=db.not_(is_deleted)
+        ).ddl_if(dialect='postgresql'),
+        db.Index(
+            'ix_user_ads_new_partial',
+            marked_new_at,
+            postgresql_where=is_new
+        ).ddl_if(dialect='postgresql'),
+        # Never reuse the id of an ad moved to archived_user_ads, which keeps it as its primary key
+        {'sqlite_autoincrement': True},
+    )
     
     @staticmethod
     def parse_czech_date(date_str):
@@ -144,37 +311,111 @@ class UserAd(db.Model):
         
         return None
 
+    @staticmethod
+    def new_cutoff():
+        """Ads marked new before this moment are no longer shown as NEW"""
+        # Use timezone-naive comparison since database stores timezone-naive datetimes
+        return datetime.utcnow() - NEW_AD_WINDOW
+    
+    @hybrid_property
+    def is_currently_new(self):
+        """Whether the ad is still inside the NEW window - no stored flag has to be cleared"""
+        return bool(self.is_new and self.marked_new_at and self.marked_new_at >= UserAd.new_cutoff())
+    
+    @is_currently_new.expression
+    def is_currently_new(cls):
+        return db.and_(cls.is_new == True, cls.marked_new_at >= cls.new_cutoff())
+    
     def to_dict(self):
-        # Calculate if ad is still "new" based on time elapsed (6 hours)
-        is_currently_new = False
-        if self.is_new and self.marked_new_at:
-            from datetime import datetime, timedelta, timezone
-            # Use timezone-naive comparison since database stores timezone-naive datetimes
-            six_hours_ago = datetime.utcnow() - timedelta(hours=6)
-            is_currently_new = self.marked_new_at >= six_hours_ago
+        # Calculate if ad is still "new" based on time elapsed
+        is_currently_new = self.is_currently_new
         
+        listing = self.listing or Listing()
         return {
             'id': self.ad_id,  # Use ad_id as the primary identifier for frontend
             'db_id': self.id,  # Keep database ID for backend operations
-            'title': self.title,
-            'description': self.description,
-            'price': self.price,
-            'location': self.location,
-            'seller_name': self.seller_name,
-            'link': self.link,
-            'image': self.image_url,  # Map image_url to image for frontend compatibility
-            'image_url': self.image_url,
-            'date_added': self.date_added,
+            'title': listing.title,
+            'description': listing.description,
+            'price': listing.price,
+            'price_value': listing.price_value,
+            'previous_price_value': listing.previous_price_value,
+            'price_dropped': listing.price_dropped,
+            'location': listing.location,
+            'seller_name': listing.seller_name,
+            'link': listing.link,
+            'image': listing.image_url,  # Map image_url to image for frontend compatibility
+            'image_url': listing.image_url,
+            'date_added': listing.date_added,
             'scraped_at': int(self.scraped_at.timestamp()) if self.scraped_at else None,
             'isNew': is_currently_new,  # Time-based NEW calculation for frontend
             'is_new': is_currently_new,  # Also provide snake_case version
             'is_deleted': self.is_deleted,
+            'is_archived': False,
             'keyword': self.keyword.keyword if self.keyword else None
         }
     
     def __repr__(self):
         return f'<UserAd {self.ad_id} for User {self.user_id}>'
 
+class UserAdKeyword(db.Model):
+    """Links an ad to every keyword of its user whose latest results contained it"""
+    __tablename__ = 'user_ad_keywords'
+    
+    user_ad_id = db.Column(db.Integer, db.ForeignKey('user_ads.id'), primary_key=True)
+    keyword_id = db.Column(db.Integer, db.ForeignKey('user_keywords.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Removing a keyword: WHERE keyword_id
+        db.Index('ix_user_ad_keywords_keyword', 'keyword_id', 'user_ad_id'),
+    )
+    
+    def __repr__(self):
+        return f'<UserAdKeyword ad {self.user_ad_id} keyword {self.keyword_id}>'
+
+class ArchivedUserAd(db.Model):
+    """Cold tier for deleted ads moved out of user_ads, queried only on request"""
+    __tablename__ = 'archived_user_ads'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Original user_ads.id, never reused
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    keyword_id = db.Column(db.Integer, db.ForeignKey('user_keywords.id'), nullable=False)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listings.id'))
+    ad_id = db.Column(db.String(100), nullable=False)
+    
+    # Metadata copied from user_ads
+    date_added_parsed = db.Column(db.DateTime)
+    scraped_at = db.Column(db.DateTime)
+    is_new = db.Column(db.Boolean, default=False)
+    marked_new_at = db.Column(db.DateTime)
+    is_deleted = db.Column(db.Boolean, default=True)
+    deleted_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    keyword = db.relationship('UserKeyword')
+    listing = db.relationship('Listing')
+    
+    __table_args__ = (
+        # Same feed ordering as ix_user_ads_feed
+        db.Index('ix_archived_user_ads_feed', 'user_id', 'date_added_parsed', 'scraped_at', 'id'),
+        # Retention purge: WHERE deleted_at < cutoff
+        db.Index('ix_archived_user_ads_deleted_at', 'deleted_at'),
+        # Feed lookups of an ad's other copies by (user_id, ad_id)
+        db.Index('ix_archived_user_ads_user_ad', 'user_id', 'ad_id'),
+    )
+    
+    # Archived ads are never shown as NEW
+    is_currently_new = False
+    
+    def to_dict(self):
+        data = UserAd.to_dict(self)
+        data['is_archived'] = True
+        return data
+    
+    def __repr__(self):
+        return f'<ArchivedUserAd {self.ad_id} for User {self.user_id}>'
+
 class UserFavorite(db.Model):
     """User's favorite ads"""
     __tablename__ = 'user_favorites'
@@ -219,11 +460,134 @@ class UserStats(db.Model):
     fastest_check_ms = db.Column(db.Integer)
     slowest_check_ms = db.Column(db.Integer)
     
+    # Live counters, adjusted in the same transaction as every keyword, ad and favorite change
+    active_keywords_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    active_ads_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    favorites_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Bumped in the same transaction as every change to the user's keywords, ads or favorites,
+    # clients compare it (or the ETag built from it) instead of re-downloading
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    @staticmethod
+    def counter_subqueries(user_id):
+        """Correlatable COUNT subqueries for active keywords, non-deleted ads and favorites"""
+        return (
+            db.select(db.func.count(UserKeyword.id)).where(
+                UserKeyword.user_id == user_id, UserKeyword.is_active == True
+            ).scalar_subquery(),
+            db.select(db.func.count(UserAd.id)).where(
+                UserAd.user_id == user_id, UserAd.is_deleted == False
+            ).scalar_subquery(),
+            db.select(db.func.count(UserFavorite.id)).where(UserFavorite.user_id == user_id).scalar_subquery()
+        )
+    
+    @classmethod
+    def create_for(cls, user_id):
+        """Create a user's stats row, counters taken from a recount in the current transaction"""
+        keywords_count, ads_count, favorites_count = db.session.query(*cls.counter_subqueries(user_id)).one()
+        stats = cls(
+            user_id=user_id,
+            total_checks=0,
+            total_ads_found=0,
+            total_ads_deleted=0,
+            avg_check_duration_ms=0,
+            active_keywords_count=keywords_count,
+            active_ads_count=ads_count,
+            favorites_count=favorites_count
+        )
+        db.session.add(stats)
+        db.session.flush()
+        return stats
+    
+    @classmethod
+    def adjust_counters(cls, user_id, keywords=0, ads=0, favorites=0):
+        """Apply counter deltas and bump the data version in the current transaction (the caller commits)"""
+        cls._update_row(user_id, cls._counter_values(keywords, ads, favorites), {cls.data_version: cls.data_version + 1})
+    
+    @classmethod
+    def bump_versions(cls, user_ids):
+        """Bump the data version of several users, user_ids may be a list or a SELECT of user ids"""
+        db.session.execute(
+            db.update(cls)
+            .where(cls.user_id.in_(user_ids))
+            .values(data_version=cls.data_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    
+    @classmethod
+    def current_version(cls, user_id):
+        """The user's data version, 0 before their first change"""
+        return db.session.query(cls.data_version).filter(cls.user_id == user_id).scalar() or 0
+    
+    @classmethod
+    def record_check(cls, user_id, check_duration_ms=None, ads_found=0, ads_deleted=0, ads=0, changed=False):
+        """Record a finished check and its active ads delta with a single UPDATE, no SELECT
+        
+        changed=True bumps the data version along with it.
+        """
+        values = {
+            cls.total_checks: db.func.coalesce(cls.total_checks, 0) + 1,
+            cls.total_ads_found: db.func.coalesce(cls.total_ads_found, 0) + ads_found,
+            cls.total_ads_deleted: db.func.coalesce(cls.total_ads_deleted, 0) + ads_deleted,
+            cls.last_check_at: datetime.utcnow()
+        }
+        
+        if check_duration_ms:
+            # Update performance metrics
+            values[cls.fastest_check_ms] = db.case(
+                (db.or_(cls.fastest_check_ms.is_(None), cls.fastest_check_ms > check_duration_ms), check_duration_ms),
+                else_=cls.fastest_check_ms
+            )
+            values[cls.slowest_check_ms] = db.case(
+                (db.or_(cls.slowest_check_ms.is_(None), cls.slowest_check_ms < check_duration_ms), check_duration_ms),
+                else_=cls.slowest_check_ms
+            )
+            # Moving average weighted 0.8 old / 0.2 new, in integer arithmetic
+            values[cls.avg_check_duration_ms] = db.case(
+                (db.func.coalesce(cls.avg_check_duration_ms, 0) == 0, check_duration_ms),
+                else_=(cls.avg_check_duration_ms * 4 + check_duration_ms) // 5
+            )
+        
+        if changed:
+            values[cls.data_version] = cls.data_version + 1
+        
+        cls._update_row(user_id, cls._counter_values(ads=ads), values)
+    
+    @classmethod
+    def _counter_values(cls, keywords=0, ads=0, favorites=0):
+        """SET clauses adding the non-zero deltas to the live counters"""
+        deltas = {
+            cls.active_keywords_count: keywords,
+            cls.active_ads_count: ads,
+            cls.favorites_count: favorites
+        }
+        return {column: column + delta for column, delta in deltas.items() if delta}
+    
+    @classmethod
+    def _update_row(cls, user_id, counter_values, other_values=None):
+        """UPDATE the user's stats row, creating it first when it does not exist yet"""
+        other_values = other_values or {}
+        values = {**counter_values, **other_values}
+        if not values:
+            return
+        
+        statement = db.update(cls).where(cls.user_id == user_id).execution_options(synchronize_session=False)
+        if db.session.execute(statement.values(values)).rowcount == 0:
+            # The recount already includes this transaction's counter changes
+            cls.create_for(user_id)
+            if other_values:
+                db.session.execute(statement.values(other_values))
+    
     def to_dict(self):
         return {
             'total_checks': self.total_checks,
             'total_ads_found': self.total_ads_found,
             'total_ads_deleted': self.total_ads_deleted,
+            'active_keywords_count': self.active_keywords_count,
+            'active_ads_count': self.active_ads_count,
+            'favorites_count': self.favorites_count,
+            'data_version': self.data_version,
             'last_check_at': self.last_check_at.isoformat() if self.last_check_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'avg_check_duration_ms': self.avg_check_duration_ms,
@@ -250,5 +614,11 @@ class UserSession(db.Model):
     # Relationships
     user = db.relationship('User', backref='sessions')
     
+    __table_args__ = (
+        # Session purge: expired sessions by age, logged out sessions by flag
+        db.Index('ix_user_sessions_expires_at', 'expires_at'),
+        db.Index('ix_user_sessions_is_active', 'is_active'),
+    )
+    
     def __repr__(self):
         return f'<UserSession {self.session_token[:8]}... for User {self.user_id}>'
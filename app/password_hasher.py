@@ -0,0 +1,78 @@
+"""
+Password hashing pool for BazosChecker
+bcrypt is deliberately slow, so hashing and verification run on a small bounded
+worker pool instead of directly on request threads. A burst of logins then queues
+for the pool rather than occupying every CPU the Socket.IO workers need.
+The cost factor is configurable and hashes with an outdated cost are upgraded on login.
+"""
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor (log2 of the number of rounds) for new hashes
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+# How many hashes may run at the same time, the rest wait in the pool's queue
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool"""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, max_workers=PASSWORD_HASH_WORKERS, timeout=30):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        """Create the pool on first use (also after a fork, where its threads do not survive)"""
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, function, *args):
+        """Run function(*args) on the pool and wait for the result"""
+        return self._pool().submit(function, *args).result(timeout=self.timeout)
+
+    def hash(self, password):
+        """bcrypt hash of password at the configured cost"""
+        return self._run(self._hash, password.encode('utf-8'), self.rounds)
+
+    def verify(self, password_hash, password):
+        """Whether password matches password_hash"""
+        if not password_hash:
+            return False
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError as e:
+            # Malformed hash, or a password bcrypt refuses (over 72 bytes)
+            logger.warning(f"Password verification failed: {e}")
+            return False
+
+    def needs_rehash(self, password_hash):
+        """Whether password_hash was made with a different cost than the configured one"""
+        return self.hash_rounds(password_hash) not in (None, self.rounds)
+
+    @staticmethod
+    def hash_rounds(password_hash):
+        """Cost factor of a '$2b$12$...' bcrypt hash, None if it cannot be read"""
+        try:
+            return int(password_hash.split('$')[2])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _hash(password, rounds):
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+# Process-wide hasher used by User.set_password / check_password
+password_hasher = PasswordHasher()
@@ -0,0 +1,80 @@
+"""
+Read replica routing for BazosChecker
+When DATABASE_READ_URL is set, SELECTs issued by read-only requests are sent to the
+replica. A user is pinned to the primary for a short window after their own writes,
+so they always read what they just wrote despite replication lag.
+"""
+import os
+import time
+import threading
+import logging
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select
+
+logger = logging.getLogger(__name__)
+
+# Bind key of the replica engine in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+# How long a user's reads stay on the primary after they wrote something
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 10))
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_last_writes = {}  # user_id -> monotonic time of the user's last write
+_last_writes_lock = threading.Lock()
+
+def record_user_write(user_id):
+    """Pin the user's reads to the primary for the read-your-writes window"""
+    now = time.monotonic()
+    with _last_writes_lock:
+        _last_writes[user_id] = now
+        # Forget users whose window has passed so the map stays small
+        if len(_last_writes) > 1000:
+            for stale_id in [uid for uid, at in _last_writes.items() if now - at > READ_YOUR_WRITES_SECONDS]:
+                del _last_writes[stale_id]
+
+def recently_wrote(user_id):
+    """Whether the user wrote within the read-your-writes window"""
+    with _last_writes_lock:
+        last_write = _last_writes.get(user_id)
+    return last_write is not None and time.monotonic() - last_write < READ_YOUR_WRITES_SECONDS
+
+def read_from_replica(f):
+    """Decorator allowing a view's SELECTs to go to the replica on GET requests
+
+    Place it below @require_auth so the current user is known.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method in SAFE_METHODS:
+            user = g.get('current_user')
+            g.read_replica = user is None or not recently_wrote(user.id)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def init_read_replica(app):
+    """Pin users to the primary after any request of theirs that may have written"""
+    @app.after_request
+    def track_user_writes(response):
+        user = g.get('current_user')
+        if user is not None and (request.method not in SAFE_METHODS or g.get('wrote_data')):
+            record_user_write(user.id)
+        return response
+
+class RoutingSession(Session):
+    """Session sending SELECTs of replica-enabled requests to the replica engine
+
+    Flushes, DML and raw SQL always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and isinstance(clause, Select) and not self._flushing and self._replica_allowed():
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_allowed(self):
+        """Only inside a request that opted in via @read_from_replica and when a replica is configured"""
+        return has_request_context() and g.get('read_replica', False) and REPLICA_BIND in self._db.engines
@@ -0,0 +1,70 @@
+"""
+Full-text search over stored listings for BazosChecker
+Listings keep a diacritics-folded copy of their title and description in search_text.
+PostgreSQL searches it through a GIN-indexed tsvector, SQLite through the listings_fts
+FTS5 table, which triggers keep in sync as listings are inserted and updated.
+"""
+import re
+import logging
+import unicodedata
+from sqlalchemy import column, func, inspect, literal_column, select, text
+from app.models import db, Listing
+
+logger = logging.getLogger(__name__)
+
+# FTS5 table mirroring listings.search_text (SQLite only)
+FTS_TABLE = 'listings_fts'
+
+# Text search configuration without stemming or stop words, the text is already folded
+TS_CONFIG = literal_column("'simple'")
+
+MAX_QUERY_TERMS = 10
+
+def fold_text(value):
+    """Lowercase and strip diacritics, so 'Žluťoučký kůň' matches 'zlutoucky kun'"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def listing_search_text(title, description):
+    """The folded text a listing is searched by"""
+    return fold_text(' '.join(part for part in (title, description) if part))
+
+def search_terms(query):
+    """Split a user query into folded word terms"""
+    return re.findall(r'\w+', fold_text(query))[:MAX_QUERY_TERMS]
+
+def search_vector():
+    """tsvector expression matching the ix_listings_search GIN index"""
+    return func.to_tsvector(TS_CONFIG, Listing.search_text)
+
+def has_fts_table():
+    """Whether the SQLite FTS5 table exists (FTS5 may be missing from the SQLite build)"""
+    return FTS_TABLE in inspect(db.engine).get_table_names()
+
+def matching_listing_ids(query):
+    """Subquery of ids of listings containing every term of the query as a word prefix
+
+    Returns None when the query has no searchable terms.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        ts_query = ' & '.join(f'{term}:*' for term in terms)
+        return select(Listing.id).where(search_vector().op('@@')(func.to_tsquery(TS_CONFIG, ts_query)))
+
+    if dialect == 'sqlite' and has_fts_table():
+        fts_query = ' '.join(f'"{term}"*' for term in terms)
+        return (
+            text(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query')
+            .bindparams(fts_query=fts_query)
+            .columns(column('rowid'))
+        )
+
+    # No full-text index available - fall back to substring matching
+    logger.warning("Full-text index unavailable, searching listings with LIKE")
+    return select(Listing.id).where(*[Listing.search_text.contains(term, autoescape=True) for term in terms])
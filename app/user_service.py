@@ -1,36 +1,107 @@
 """
 User service for handling user-specific operations
 """
+import base64
 import json
 import os
+import threading
 import time
-from datetime import datetime, timedelta, timezone
-from app.models import db, User, UserKeyword, UserAd, UserFavorite, UserStats
+from datetime import datetime, timedelta
+from app.models import db, User, UserKeyword, Listing, PriceHistory, UserAd, UserAdKeyword, ArchivedUserAd, UserFavorite, UserStats
+from app.db_writer import db_writer
+from app.search import listing_search_text, matching_listing_ids
 from app.utils.bazos_scraper_fixed import BazosScraper
 import logging
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import and_, case, delete, exists, extract, func, insert, literal_column, or_, select, union, update
+from sqlalchemy.orm import aliased, joinedload
 
 logger = logging.getLogger(__name__)
 
-def retry_db_operation(operation, max_retries=3, delay=0.1):
-    """Retry database operation if it fails due to database lock"""
-    for attempt in range(max_retries):
-        try:
-            return operation()
-        except OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                logger.warning(f"Database locked, retrying in {delay}s (attempt {attempt + 1}/{max_retries})")
-                time.sleep(delay)
-                delay *= 2  # Exponential backoff
-            else:
-                raise
-    return None
+# Uptime reported in user stats, counted from when the service was loaded
+SERVICE_STARTED_AT = datetime.now()
+
+# How long scraped results are reused for the same canonical keyword, so every user
+# tracking a search within one check cycle shares a single scrape
+SCRAPE_CACHE_SECONDS = float(os.getenv('SCRAPE_CACHE_SECONDS', 60))
+
+# Users loaded per chunk by the scheduled check cycle
+CHECK_USER_BATCH_SIZE = int(os.getenv('CHECK_USER_BATCH_SIZE', 100))
+
+# Listing columns a scrape rewrites, compared first so unchanged listings are left alone
+LISTING_CONTENT_FIELDS = (
+    'title', 'description', 'price', 'location', 'seller_name', 'link', 'image_url', 'date_added', 'date_added_parsed'
+)
+
+# Time on market histogram: (upper bound in days, bucket label), longer listings go to the last label
+TIME_ON_MARKET_BUCKETS = ((1, '<1d'), (3, '1-3d'), (7, '3-7d'), (14, '7-14d'), (30, '14-30d'))
+TIME_ON_MARKET_OVERFLOW = '30d+'
+
+def days_between(end, start):
+    """SQL expression for the (fractional) number of days from start to end"""
+    if db.engine.dialect.name == 'postgresql':
+        return extract('epoch', end - start) / 86400.0
+    return func.julianday(end) - func.julianday(start)
+
+def display_loads(model=UserAd):
+    """Everything to_dict() reads, loaded with the ads instead of one lazy SELECT per ad"""
+    return joinedload(model.listing), joinedload(model.keyword)
+
+def insert_ignore(model, *conflict_columns):
+    """INSERT that silently skips rows violating a unique constraint"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model).on_conflict_do_nothing(index_elements=list(conflict_columns))
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model).on_conflict_do_nothing(index_elements=list(conflict_columns))
+    return insert(model)
+
+def encode_cursor(ad):
+    """Opaque keyset cursor pointing just past the given ad in feed order"""
+    position = [
+        ad.date_added_parsed.isoformat() if ad.date_added_parsed else None,
+        ad.scraped_at.isoformat() if ad.scraped_at else None,
+        ad.id
+    ]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor into (date_added_parsed, scraped_at, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_added, scraped_at, ad_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (
+            datetime.fromisoformat(date_added) if date_added else None,
+            datetime.fromisoformat(scraped_at) if scraped_at else None,
+            int(ad_id)
+        )
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
 
 class UserService:
     """Service for handling user-specific operations"""
     
     def __init__(self, scraper=None):
         self.scraper = scraper or BazosScraper()
+        self._search_cache = {}  # canonical keyword -> (expires_at, ads)
+        self._search_lock = threading.Lock()
+    
+    def search_keyword(self, canonical):
+        """Scraped ads for a canonical keyword, reused for SCRAPE_CACHE_SECONDS across users"""
+        now = time.monotonic()
+        with self._search_lock:
+            cached = self._search_cache.get(canonical)
+        if cached and cached[0] > now:
+            logger.debug(f"Scrape cache hit for '{canonical}'")
+            return [dict(ad) for ad in cached[1]]
+        
+        ads = self.scraper.search(canonical)
+        with self._search_lock:
+            # Drop expired searches so the cache only holds the current cycle
+            self._search_cache = {key: entry for key, entry in self._search_cache.items() if entry[0] > now}
+            self._search_cache[canonical] = (now + SCRAPE_CACHE_SECONDS, ads)
+        return [dict(ad) for ad in ads]
     
     def get_user_keywords(self, user_id):
         """Get all keywords for a user"""
@@ -40,33 +111,44 @@ class UserService:
     def add_user_keyword(self, user_id, keyword):
         """Add a keyword for a user"""
         try:
-            # Check if keyword already exists for this user
-            existing = UserKeyword.query.filter_by(
-                user_id=user_id, 
-                keyword=keyword
-            ).first()
+            # Check if keyword already exists for this user, spelled any way that searches the same
+            canonical = UserKeyword.canonicalize(keyword)
+            existing = UserKeyword.query.filter(
+                UserKeyword.user_id == user_id,
+                or_(UserKeyword.keyword == keyword, UserKeyword.canonical == canonical)
+            ).order_by(UserKeyword.is_active.desc()).first()
             
             if existing:
                 if existing.is_active:
                     return False, "Keyword already exists"
                 else:
                     # Reactivate existing keyword
-                    existing.is_active = True
-                    db.session.commit()
+                    keyword_id = existing.id
+                    
+                    def _reactivate_keyword():
+                        if UserKeyword.query.filter_by(id=keyword_id, is_active=False).update({'is_active': True}):
+                            UserStats.adjust_counters(user_id, keywords=1)
+                    
+                    db_writer.run(_reactivate_keyword)
                     return True, "Keyword reactivated"
             
             # Create new keyword
-            user_keyword = UserKeyword(
-                user_id=user_id,
-                keyword=keyword
-            )
-            db.session.add(user_keyword)
-            db.session.commit()
+            def _create_keyword():
+                user_keyword = UserKeyword(
+                    user_id=user_id,
+                    keyword=keyword
+                )
+                db.session.add(user_keyword)
+                db.session.flush()
+                UserStats.adjust_counters(user_id, keywords=1)
+                return user_keyword.id
+            
+            keyword_id = db_writer.run(_create_keyword)
             
             # Try to fetch initial ads (don't mark as new for existing ads)
             try:
-                initial_ads = self.scraper.search(keyword)
-                self.save_user_ads(user_id, user_keyword.id, initial_ads, mark_as_new=False)
+                initial_ads = self.search_keyword(canonical)
+                self.save_user_ads(user_id, keyword_id, initial_ads, mark_as_new=False)
                 logger.info(f"Added keyword '{keyword}' for user {user_id} with {len(initial_ads)} initial ads (not marked as new)")
             except Exception as e:
                 logger.error(f"Failed to fetch initial ads for keyword '{keyword}': {e}")
@@ -89,16 +171,49 @@ class UserService:
             if not user_keyword:
                 return False, "Keyword not found"
             
-            # Soft delete - mark as inactive
-            user_keyword.is_active = False
+            keyword_id = user_keyword.id
             
-            # Also mark all ads for this keyword as deleted
-            UserAd.query.filter_by(
-                user_id=user_id,
-                keyword_id=user_keyword.id
-            ).update({'is_deleted': True})
+            def _remove_keyword():
+                # Soft delete - mark as inactive
+                keywords_removed = UserKeyword.query.filter_by(id=keyword_id, is_active=True).update({'is_active': False})
+                
+                # Ads the keyword matched, plus live ads shown under it
+                affected = set(db.session.scalars(
+                    select(UserAdKeyword.user_ad_id).where(UserAdKeyword.keyword_id == keyword_id)
+                ))
+                affected.update(db.session.scalars(
+                    select(UserAd.id).where(UserAd.user_id == user_id, UserAd.keyword_id == keyword_id, UserAd.is_deleted == False)
+                ))
+                db.session.execute(delete(UserAdKeyword).where(UserAdKeyword.keyword_id == keyword_id))
+                
+                ads_removed = 0
+                if affected:
+                    # Ads another keyword still matches move under it, the rest are marked as deleted
+                    other_keyword = (
+                        select(func.min(UserAdKeyword.keyword_id))
+                        .where(UserAdKeyword.user_ad_id == UserAd.id)
+                        .scalar_subquery()
+                    )
+                    db.session.execute(
+                        update(UserAd)
+                        .where(UserAd.id.in_(affected), UserAd.keyword_id == keyword_id, other_keyword.is_not(None))
+                        .values(keyword_id=other_keyword)
+                        .execution_options(synchronize_session=False)
+                    )
+                    ads_removed = db.session.execute(
+                        update(UserAd)
+                        .where(
+                            UserAd.id.in_(affected),
+                            UserAd.is_deleted == False,
+                            ~exists().where(UserAdKeyword.user_ad_id == UserAd.id)
+                        )
+                        .values(is_deleted=True, deleted_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                
+                UserStats.adjust_counters(user_id, keywords=-keywords_removed, ads=-ads_removed)
             
-            db.session.commit()
+            db_writer.run(_remove_keyword)
             logger.info(f"Removed keyword '{keyword}' for user {user_id}")
             return True, "Keyword removed successfully"
             
@@ -109,45 +224,55 @@ class UserService:
     
     def save_user_ads(self, user_id, keyword_id, ads, mark_as_new=True):
         """Save ads for a user and keyword"""
+        ads_by_id = {ad_data['id']: ad_data for ad_data in ads}
+        if not ads_by_id:
+            return True
+        
+        def _save():
+            listing_ids = self._ensure_listings(ads_by_id, refresh=True)
+            self._mark_listings_seen(list(listing_ids.values()), datetime.utcnow())
+            
+            existing = {
+                row.ad_id: (row.id, row.is_deleted)
+                for row in db.session.query(UserAd.ad_id, UserAd.id, UserAd.is_deleted).filter(
+                    UserAd.user_id == user_id,
+                    UserAd.ad_id.in_(list(ads_by_id))
+                )
+            }
+            
+            current_time = datetime.utcnow()
+            new_rows = [
+                self._new_ad_row(user_id, keyword_id, listing_ids[ad_id], ad_data, current_time, mark_as_new)
+                for ad_id, ad_data in ads_by_id.items()
+                if ad_id not in existing
+            ]
+            if new_rows:
+                db.session.execute(insert(UserAd), new_rows)
+            
+            # Mark as not deleted if it was, it is now shown under this keyword
+            undeleted = [db_id for db_id, is_deleted in existing.values() if is_deleted]
+            if undeleted:
+                db.session.execute(
+                    update(UserAd)
+                    .where(UserAd.id.in_(undeleted))
+                    .values(is_deleted=False, deleted_at=None, keyword_id=keyword_id)
+                    .execution_options(synchronize_session=False)
+                )
+            
+            # Link every ad to the keyword, including ads other keywords found first
+            ad_ids = [db_id for db_id, _ in existing.values()]
+            if new_rows:
+                ad_ids.extend(db.session.scalars(
+                    select(UserAd.id).where(UserAd.user_id == user_id, UserAd.ad_id.in_([row['ad_id'] for row in new_rows]))
+                ))
+            db.session.execute(insert_ignore(UserAdKeyword, 'user_ad_id', 'keyword_id'), [
+                {'user_ad_id': db_id, 'keyword_id': keyword_id, 'created_at': current_time} for db_id in ad_ids
+            ])
+            
+            UserStats.adjust_counters(user_id, ads=len(new_rows) + len(undeleted))
+        
         try:
-            for ad_data in ads:
-                # Check if ad already exists
-                existing = UserAd.query.filter_by(
-                    user_id=user_id,
-                    ad_id=ad_data['id']
-                ).first()
-                
-                if existing:
-                    # Update existing ad
-                    existing.title = ad_data.get('title', existing.title)
-                    existing.description = ad_data.get('description', existing.description)
-                    existing.price = ad_data.get('price', existing.price)
-                    existing.location = ad_data.get('location', existing.location)
-                    existing.seller_name = ad_data.get('seller_name', existing.seller_name)
-                    existing.is_deleted = False  # Mark as not deleted if it was
-                else:
-                    # Create new ad
-                    date_added_str = ad_data.get('date_added', '')
-                    current_time = datetime.utcnow()
-                    user_ad = UserAd(
-                        user_id=user_id,
-                        keyword_id=keyword_id,
-                        ad_id=ad_data['id'],
-                        title=ad_data.get('title', ''),
-                        description=ad_data.get('description', ''),
-                        price=ad_data.get('price', ''),
-                        location=ad_data.get('location', ''),
-                        seller_name=ad_data.get('seller_name', ''),
-                        link=ad_data.get('link', ''),
-                        image_url=ad_data.get('image_url', ''),
-                        date_added=date_added_str,
-                        date_added_parsed=UserAd.parse_czech_date(date_added_str),
-                        is_new=mark_as_new,
-                        marked_new_at=current_time if mark_as_new else None
-                    )
-                    db.session.add(user_ad)
-            
-            db.session.commit()
+            db_writer.run(_save)
             return True
             
         except Exception as e:
@@ -155,47 +280,353 @@ class UserService:
             logger.error(f"Error saving ads for user {user_id}: {e}")
             return False
     
-    def get_user_ads(self, user_id, keyword=None, include_deleted=False):
-        """Get ads for a user"""
-        query = UserAd.query.filter_by(user_id=user_id)
+    def _listing_row(self, ad_data, current_time):
+        """Build the shared listing content for a scraped ad"""
+        date_added_str = ad_data.get('date_added', '')
+        return {
+            'ad_id': ad_data['id'],
+            'title': ad_data.get('title', ''),
+            'description': ad_data.get('description', ''),
+            'price': ad_data.get('price', ''),
+            'location': ad_data.get('location', ''),
+            'seller_name': ad_data.get('seller_name', ''),
+            'link': ad_data.get('link', ''),
+            'image_url': ad_data.get('image_url', ''),
+            'date_added': date_added_str,
+            'date_added_parsed': UserAd.parse_czech_date(date_added_str),
+            'search_text': listing_search_text(ad_data.get('title', ''), ad_data.get('description', '')),
+            'updated_at': current_time
+        }
+    
+    def _ensure_listings(self, ads_by_id, refresh=False):
+        """Make sure every scraped ad has a shared listing row
+        
+        Returns {ad_id: listing_id}. Missing listings are inserted once no matter
+        how many users track them; with refresh=True the content of listings that
+        already existed is overwritten with the scraped data where it differs. Price
+        changes of existing listings are recorded either way.
+        """
+        if not ads_by_id:
+            return {}
+        
+        current_time = datetime.utcnow()
+        stored_prices = {}
+        stored_content = {}
+        listing_ids = {}
+        content_columns = [getattr(Listing, field) for field in LISTING_CONTENT_FIELDS] if refresh else []
+        for row in db.session.query(Listing.ad_id, Listing.id, Listing.price_value, *content_columns).filter(
+            Listing.ad_id.in_(list(ads_by_id))
+        ):
+            listing_ids[row.ad_id] = row.id
+            stored_prices[row.ad_id] = row.price_value
+            stored_content[row.ad_id] = tuple(row[3:])
+        
+        if refresh and listing_ids:
+            # Rewrite, and invalidate the ETags of users tracking, only listings whose content changed
+            changed = []
+            for ad_id, listing_id in listing_ids.items():
+                content = self._listing_row(ads_by_id[ad_id], current_time)
+                if tuple(content[field] for field in LISTING_CONTENT_FIELDS) != stored_content[ad_id]:
+                    changed.append(dict(content, id=listing_id))
+            if changed:
+                db.session.execute(update(Listing), changed)
+                self._bump_listing_versions([row['id'] for row in changed])
+        
+        price_changes = []
+        for ad_id, listing_id in listing_ids.items():
+            change = self._price_change(listing_id, ads_by_id[ad_id].get('price', ''), stored_prices[ad_id])
+            if change:
+                price_changes.append(change)
+        self._record_price_changes(price_changes, current_time)
+        
+        missing = [ad_id for ad_id in ads_by_id if ad_id not in listing_ids]
+        if missing:
+            # Another process may insert the same listing concurrently
+            db.session.execute(insert_ignore(Listing, 'ad_id'), [
+                dict(
+                    self._listing_row(ads_by_id[ad_id], current_time),
+                    price_value=Listing.parse_price(ads_by_id[ad_id].get('price', '')),
+                    created_at=current_time,
+                    first_seen_at=current_time  # The sighting itself is counted by _mark_listings_seen
+                )
+                for ad_id in missing
+            ])
+            inserted = dict(
+                db.session.query(Listing.ad_id, Listing.id).filter(Listing.ad_id.in_(missing))
+            )
+            listing_ids.update(inserted)
+            
+            # The first observed price starts each listing's timeline
+            baseline = [
+                self._price_change(listing_id, ads_by_id[ad_id].get('price', ''), None)
+                for ad_id, listing_id in inserted.items()
+            ]
+            self._record_price_changes([change for change in baseline if change], current_time, history_only=True)
+        
+        return listing_ids
+    
+    def _mark_listings_seen(self, listing_ids, current_time):
+        """One set-based UPDATE recording that a scrape found these listings
+        
+        Users sharing a search share its scrape for SCRAPE_CACHE_SECONDS, a listing
+        already seen within that window is not counted again.
+        """
+        if not listing_ids:
+            return
+        db.session.execute(
+            update(Listing)
+            .where(
+                Listing.id.in_(listing_ids),
+                or_(Listing.last_seen_at.is_(None), Listing.last_seen_at < current_time - timedelta(seconds=SCRAPE_CACHE_SECONDS))
+            )
+            .values(last_seen_at=current_time, seen_count=Listing.seen_count + 1, deleted_at=None)
+            .execution_options(synchronize_session=False)
+        )
+    
+    def _mark_listings_missing(self, listing_ids, current_time):
+        """One set-based UPDATE recording that these listings dropped out of search results
+        
+        Listings another user's scrape found within the same window stay on the market.
+        """
+        if not listing_ids:
+            return
+        db.session.execute(
+            update(Listing)
+            .where(
+                Listing.id.in_(listing_ids),
+                Listing.deleted_at.is_(None),
+                or_(Listing.last_seen_at.is_(None), Listing.last_seen_at < current_time - timedelta(seconds=SCRAPE_CACHE_SECONDS))
+            )
+            .values(deleted_at=current_time)
+            .execution_options(synchronize_session=False)
+        )
+    
+    def _bump_listing_versions(self, listing_ids):
+        """Listings are shared, a content or price change is a change for every user tracking them"""
+        UserStats.bump_versions(
+            select(UserAd.user_id).where(UserAd.listing_id.in_(listing_ids)).distinct().scalar_subquery()
+        )
+    
+    def _price_change(self, listing_id, price, stored_value):
+        """Price update for a listing, None when the scraped price has no amount or is unchanged"""
+        value = Listing.parse_price(price)
+        if value is None or value == stored_value:
+            return None
+        return {'id': listing_id, 'price': price, 'price_value': value, 'previous_price_value': stored_value}
+    
+    def _record_price_changes(self, changes, current_time, history_only=False):
+        """Store changed listing prices and append them to price_history"""
+        if not changes:
+            return
+        
+        if not history_only:
+            db.session.execute(update(Listing), [
+                dict(change, price_changed_at=current_time) for change in changes
+            ])
+            self._bump_listing_versions([change['id'] for change in changes])
+        db.session.execute(insert(PriceHistory), [
+            {
+                'listing_id': change['id'],
+                'price': change['price'],
+                'price_value': change['price_value'],
+                'recorded_at': current_time
+            }
+            for change in changes
+        ])
+    
+    @staticmethod
+    def recent_ads_query(user_id, include_deleted=False, keyword=None, model=UserAd):
+        """Feed query: newest first by posting date, then scrape time (served by ix_user_ads_feed)
+        
+        Pass model=ArchivedUserAd to run the same query against the archive, which only
+        holds deleted ads and is read whatever include_deleted says.
+        """
+        query = model.query.filter(model.user_id == user_id).options(*display_loads(model))
         
         if keyword:
-            # Join with UserKeyword to filter by keyword
-            query = query.join(UserKeyword).filter(UserKeyword.keyword == keyword)
+            query = UserService._filter_by_keyword(query, keyword, model)
+        
+        if model is ArchivedUserAd:
+            query = UserService._unique_archived(query, include_deleted)
+        elif not include_deleted:
+            query = query.filter(model.is_deleted == False)
         
+        return query.order_by(
+            model.date_added_parsed.desc().nulls_last(),
+            model.scraped_at.desc(),
+            model.id.desc()
+        )
+    
+    @staticmethod
+    def _filter_by_keyword(query, keyword, model=UserAd):
+        """Limit an ads query to one keyword: ads shown under it plus live ads it also matches"""
+        keyword_match = model.keyword_id == UserKeyword.id
+        if model is UserAd:
+            keyword_match = or_(keyword_match, exists().where(
+                UserAdKeyword.user_ad_id == model.id,
+                UserAdKeyword.keyword_id == UserKeyword.id
+            ))
+        return query.join(UserKeyword, and_(UserKeyword.user_id == model.user_id, keyword_match)).filter(
+            UserKeyword.keyword == keyword
+        )
+    
+    @staticmethod
+    def _unique_archived(query, include_deleted=False):
+        """Drop archived copies of ads the feed also shows, so every Bazos ad appears once
+        
+        An ad that reappeared after being archived is shown as its live row, an ad
+        archived more than once as its latest archived copy.
+        """
+        live = exists().where(UserAd.user_id == ArchivedUserAd.user_id, UserAd.ad_id == ArchivedUserAd.ad_id)
         if not include_deleted:
-            query = query.filter(UserAd.is_deleted == False)
+            live = live.where(UserAd.is_deleted == False)
+        newer = aliased(ArchivedUserAd)
+        newer_copy = exists().where(
+            newer.user_id == ArchivedUserAd.user_id,
+            newer.ad_id == ArchivedUserAd.ad_id,
+            newer.id > ArchivedUserAd.id
+        )
+        return query.filter(~live, ~newer_copy)
+    
+    @staticmethod
+    def _after_cursor(position, model=UserAd):
+        """Keyset predicate selecting ads that sort after the cursor position in feed order"""
+        date_added, scraped_at, ad_id = position
+        same_date = or_(
+            model.scraped_at < scraped_at,
+            and_(model.scraped_at == scraped_at, model.id < ad_id)
+        )
+        if date_added is None:
+            # Undated ads sort last, so only undated ads can follow
+            return and_(model.date_added_parsed.is_(None), same_date)
+        return or_(
+            model.date_added_parsed < date_added,
+            model.date_added_parsed.is_(None),
+            and_(model.date_added_parsed == date_added, same_date)
+        )
+    
+    @staticmethod
+    def _feed_sort_key(ad):
+        """Python equivalent of the feed ORDER BY, used when merging hot and archived ads"""
+        return (ad.date_added_parsed is not None, ad.date_added_parsed or datetime.min, ad.scraped_at or datetime.min, ad.id)
+    
+    def get_user_ads_page(self, user_id, limit=100, cursor=None, keyword=None, include_deleted=False,
+                          include_archived=False):
+        """Get one page of a user's ads in feed order using keyset pagination
+        
+        Returns (ads, next_cursor); next_cursor is None on the last page. Raises
+        ValueError for a malformed cursor. With include_archived the archive is
+        paged with the same cursor and merged in.
+        """
+        position = decode_cursor(cursor) if cursor else None
+        models = (UserAd, ArchivedUserAd) if include_archived else (UserAd,)
+        
+        ads = []
+        for model in models:
+            query = self.recent_ads_query(user_id, include_deleted, keyword, model=model)
+            if position:
+                query = query.filter(self._after_cursor(position, model))
+            
+            # Fetch one extra row to know whether another page exists
+            ads.extend(query.limit(limit + 1).all())
         
-        ads = query.order_by(UserAd.scraped_at.desc()).all()
+        if len(models) > 1:
+            ads.sort(key=self._feed_sort_key, reverse=True)
+            ads = ads[:limit + 1]
+        
+        next_cursor = encode_cursor(ads[limit - 1]) if len(ads) > limit else None
+        ads = [ad.to_dict() for ad in ads[:limit]]
+        logger.info(f"Retrieved {len(ads)} ads for user {user_id} (limit: {limit}, keyword: {keyword}, more: {next_cursor is not None})")
+        return ads, next_cursor
+    
+    def search_user_ads(self, user_id, query, limit=100, include_deleted=False):
+        """Full-text search of a user's ads by title and description, newest first
+        
+        Matching ignores case and Czech diacritics, every word of the query must
+        appear as a word prefix. Raises ValueError when the query has no words.
+        """
+        listing_ids = matching_listing_ids(query)
+        if listing_ids is None:
+            raise ValueError("Search query is empty")
+        
+        ads = self.recent_ads_query(user_id, include_deleted).filter(
+            UserAd.listing_id.in_(listing_ids)
+        ).limit(limit).all()
+        logger.info(f"Search '{query}' matched {len(ads)} ads for user {user_id}")
         return [ad.to_dict() for ad in ads]
     
-    def get_user_recent_ads(self, user_id, limit=100, include_deleted=False):
-        """Get recent ads for a user, sorted by newest first (by posting date, then scrape time)"""
-        def _get_ads():
-            query = UserAd.query.filter_by(user_id=user_id)
-            
-            if not include_deleted:
-                query = query.filter_by(is_deleted=False)
-            
-            ads = query.order_by(
-                UserAd.date_added_parsed.desc().nulls_last(),
-                UserAd.scraped_at.desc(),
-                UserAd.id.desc()
-            ).limit(limit).all()
-            
-            return [ad.to_dict() for ad in ads]
+    def get_ad_price_history(self, user_id, bazos_ad_id):
+        """Price timeline of one of the user's ads, oldest first, or None if the user has no such ad"""
+        listing_id = None
+        for model in (UserAd, ArchivedUserAd):
+            row = db.session.query(model.listing_id).filter_by(user_id=user_id, ad_id=bazos_ad_id).first()
+            if row:
+                listing_id = row.listing_id
+                break
+        else:
+            return None
         
-        try:
-            result = retry_db_operation(_get_ads)
-            logger.info(f"Retrieved {len(result)} recent ads for user {user_id} (limit: {limit}, include_deleted: {include_deleted})")
-            return result
-        except Exception as e:
-            logger.error(f"Failed to get recent ads for user {user_id}: {e}")
-            return []
+        history = PriceHistory.query.filter_by(listing_id=listing_id).order_by(
+            PriceHistory.recorded_at, PriceHistory.id
+        ).all()
+        return [entry.to_dict() for entry in history]
+    
+    def get_time_on_market(self, user_id):
+        """Per keyword distribution of how long the user's ads stayed listed, aggregated in SQL
+        
+        Covers listings that have left the market, measured from when they were first
+        seen. Archived ads count under the keyword they were shown under.
+        """
+        ended = union(
+            select(UserAd.keyword_id, UserAd.listing_id).where(UserAd.user_id == user_id, UserAd.is_deleted == True),
+            select(ArchivedUserAd.keyword_id, ArchivedUserAd.listing_id).where(ArchivedUserAd.user_id == user_id)
+        ).subquery()
+        days = days_between(Listing.deleted_at, Listing.first_seen_at)
+        bucket = case(*[(days < limit, label) for limit, label in TIME_ON_MARKET_BUCKETS], else_=TIME_ON_MARKET_OVERFLOW)
+        
+        rows = db.session.execute(
+            select(
+                UserKeyword.keyword,
+                bucket.label('bucket'),
+                func.count().label('listings'),
+                func.sum(days).label('total_days'),
+                func.min(days).label('min_days'),
+                func.max(days).label('max_days')
+            )
+            .select_from(ended)
+            .join(Listing, Listing.id == ended.c.listing_id)
+            .join(UserKeyword, UserKeyword.id == ended.c.keyword_id)
+            .where(Listing.deleted_at.is_not(None), Listing.first_seen_at.is_not(None))
+            .group_by(UserKeyword.keyword, literal_column('bucket'))
+        )
+        
+        # Fold the per-bucket rows into one distribution per keyword
+        labels = [label for _, label in TIME_ON_MARKET_BUCKETS] + [TIME_ON_MARKET_OVERFLOW]
+        totals = {}  # keyword -> [listings, total days, min days, max days]
+        buckets = {}
+        for row in rows:
+            total = totals.setdefault(row.keyword, [0, 0.0, row.min_days, row.max_days])
+            total[0] += row.listings
+            total[1] += row.total_days
+            total[2] = min(total[2], row.min_days)
+            total[3] = max(total[3], row.max_days)
+            buckets.setdefault(row.keyword, dict.fromkeys(labels, 0))[row.bucket] = row.listings
+        
+        return [
+            {
+                'keyword': keyword,
+                'listings': listings,
+                'avg_days': round(total_days / listings, 1),
+                'min_days': round(min_days, 1),
+                'max_days': round(max_days, 1),
+                'buckets': buckets[keyword]
+            }
+            for keyword, (listings, total_days, min_days, max_days) in sorted(totals.items())
+        ]
     
     def toggle_user_favorite(self, user_id, bazos_ad_id):
         """Toggle favorite status for an ad using Bazos ad ID"""
-        try:
+        def _toggle():
             # Find the ad by Bazos ad_id (string)
             ad = UserAd.query.filter_by(user_id=user_id, ad_id=bazos_ad_id).first()
             if not ad:
@@ -210,15 +641,17 @@ class UserService:
             if existing_favorite:
                 # Remove favorite
                 db.session.delete(existing_favorite)
-                db.session.commit()
+                UserStats.adjust_counters(user_id, favorites=-1)
                 return True, "Removed from favorites"
             else:
                 # Add favorite using database ID
                 favorite = UserFavorite(user_id=user_id, ad_id=ad.id)
                 db.session.add(favorite)
-                db.session.commit()
+                UserStats.adjust_counters(user_id, favorites=1)
                 return True, "Added to favorites"
-                
+        
+        try:
+            return db_writer.run(_toggle)
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error toggling favorite for user {user_id}: {e}")
@@ -226,58 +659,24 @@ class UserService:
     
     def get_user_favorites(self, user_id):
         """Get user's favorite ads"""
-        favorites = UserFavorite.query.filter_by(user_id=user_id).all()
+        # Load each favorite's ad, listing and keyword in the same query
+        favorites = UserFavorite.query.filter_by(user_id=user_id).options(
+            joinedload(UserFavorite.ad).joinedload(UserAd.listing),
+            joinedload(UserFavorite.ad).joinedload(UserAd.keyword)
+        ).all()
         return [fav.to_dict() for fav in favorites]
     
     def get_user_stats(self, user_id):
-        """Get user statistics"""
+        """Get user statistics from the user's counters row, no COUNT queries or file reads"""
         stats = UserStats.query.filter_by(user_id=user_id).first()
-        if not stats:
-            # Create default stats
-            stats = UserStats(user_id=user_id)
-            db.session.add(stats)
-            db.session.commit()
-        
-        # Add additional calculated stats
-        stats_dict = stats.to_dict()
-        
-        # Count active keywords
-        active_keywords = UserKeyword.query.filter_by(
-            user_id=user_id,
-            is_active=True
-        ).count()
-        
-        # Count total ads
-        total_ads = UserAd.query.filter_by(
-            user_id=user_id,
-            is_deleted=False
-        ).count()
-        
-        # Count favorites
-        favorites_count = UserFavorite.query.filter_by(user_id=user_id).count()
-        
-        # Calculate system uptime from app start time (not user creation)
-        import os
-        uptime_seconds = 0
-        try:
-            # Try to get system uptime from stats file if available
-            stats_file = "data/stats.json"
-            if os.path.exists(stats_file):
-                import json
-                with open(stats_file, 'r', encoding='utf-8-sig') as f:
-                    global_stats = json.load(f)
-                    system_stats = global_stats.get('system', {})
-                    start_time_str = system_stats.get('start_time')
-                    if start_time_str:
-                        from datetime import datetime
-                        start_time = datetime.fromisoformat(start_time_str)
-                        uptime_seconds = int((datetime.now() - start_time).total_seconds())
-        except Exception as e:
-            logger.warning(f"Could not calculate system uptime: {e}")
-            # Fallback to user creation time
-            user = User.query.get(user_id)
-            if user and user.created_at:
-                uptime_seconds = int((datetime.utcnow() - user.created_at).total_seconds())
+        if stats:
+            stats_dict = stats.to_dict()
+        else:
+            # Create default stats, read back from the writer (a replica may not have the row yet)
+            stats_dict = db_writer.run(lambda: UserStats.create_for(user_id).to_dict())
+        
+        # System uptime counts from when this process started serving
+        uptime_seconds = int((datetime.now() - SERVICE_STARTED_AT).total_seconds())
         
         # Get check interval from environment
         check_interval = int(os.getenv('CHECK_INTERVAL', 300))
@@ -286,12 +685,12 @@ class UserService:
         # Format stats to match frontend expectations
         formatted_stats = {
             'total_checks': stats_dict.get('total_checks', 0),
-            'total_ads': total_ads,
+            'total_ads': stats_dict.get('active_ads_count', 0),
             'uptime': self._format_uptime(uptime_seconds),
             'uptime_seconds': uptime_seconds,
             'avg_duration': stats_dict.get('avg_check_duration_ms', 0),
-            'active_keywords': active_keywords,
-            'favorites_count': favorites_count,
+            'active_keywords': stats_dict.get('active_keywords_count', 0),
+            'favorites_count': stats_dict.get('favorites_count', 0),
             'check_interval': check_interval,
             'check_interval_minutes': check_interval_minutes,
             'last_check_at': stats_dict.get('last_check_at'),
@@ -299,63 +698,62 @@ class UserService:
         
         return formatted_stats
     
-    def update_user_stats(self, user_id, check_duration_ms=None, ads_found=0, ads_deleted=0):
-        """Update user statistics"""
-        try:
-            stats = UserStats.query.filter_by(user_id=user_id).first()
-            if not stats:
-                stats = UserStats(user_id=user_id)
-                db.session.add(stats)
-            
-            # Update stats
-            stats.total_checks += 1
-            stats.total_ads_found += ads_found
-            stats.total_ads_deleted += ads_deleted
-            stats.last_check_at = datetime.utcnow()
-            
-            if check_duration_ms:
-                # Update performance metrics
-                if stats.fastest_check_ms is None or check_duration_ms < stats.fastest_check_ms:
-                    stats.fastest_check_ms = check_duration_ms
-                
-                if stats.slowest_check_ms is None or check_duration_ms > stats.slowest_check_ms:
-                    stats.slowest_check_ms = check_duration_ms
-                
-                # Update average (simple moving average)
-                if stats.avg_check_duration_ms == 0:
-                    stats.avg_check_duration_ms = check_duration_ms
-                else:
-                    stats.avg_check_duration_ms = int(
-                        (stats.avg_check_duration_ms * 0.8) + (check_duration_ms * 0.2)
-                    )
+    def _new_ad_row(self, user_id, keyword_id, listing_id, ad_data, current_time, mark_as_new=True):
+        """Build an insert mapping for a user's subscription to a listing"""
+        return {
+            'user_id': user_id,
+            'keyword_id': keyword_id,
+            'listing_id': listing_id,
+            'ad_id': ad_data['id'],
+            'date_added_parsed': UserAd.parse_czech_date(ad_data.get('date_added', '')),
+            'scraped_at': current_time,
+            'is_new': mark_as_new,
+            'marked_new_at': current_time if mark_as_new else None
+        }
+    
+    @staticmethod
+    def iter_users_to_check(batch_size=CHECK_USER_BATCH_SIZE):
+        """Yield (id, username) of active users with at least one active keyword, in id order
+        
+        Users are read batch_size at a time by id range rather than through one open
+        cursor, since every check commits. The session is closed after each batch so
+        ORM state loaded by the checks never outlives its batch.
+        """
+        last_id = 0
+        while True:
+            batch = db.session.execute(
+                select(User.id, User.username)
+                .where(
+                    User.is_active == True,
+                    User.id > last_id,
+                    exists().where(UserKeyword.user_id == User.id, UserKeyword.is_active == True)
+                )
+                .order_by(User.id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                return
             
-            db.session.commit()
-            return True
+            yield from batch
             
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Error updating stats for user {user_id}: {e}")
-            return False
+            last_id = batch[-1].id
+            db.session.close()
+            if len(batch) < batch_size:
+                return
     
     def check_user_ads(self, user_id):
-        """Check for new ads for a specific user"""
+        """Check for new ads for a specific user
+        
+        The diff runs entirely in memory: one projected read of everything the
+        user already has, hash maps keyed by Bazos ad ID, and one batched write
+        (bulk insert + bulk updates + the user's check stats) committed in a
+        single transaction.
+        """
         try:
             start_time = datetime.utcnow()
             new_ads = []
             deleted_ads = []
             
-            # Clear "NEW" tags from ads older than 6 hours
-            # This gives users time to see new ads without them disappearing immediately
-            six_hours_ago = datetime.now(timezone.utc) - timedelta(hours=6)
-            old_new_ads = UserAd.query.filter(
-                UserAd.user_id == user_id,
-                UserAd.is_new == True,
-                UserAd.marked_new_at < six_hours_ago
-            ).update({'is_new': False})
-            
-            if old_new_ads > 0:
-                logger.info(f"Cleared NEW tag from {old_new_ads} ads older than 6 hours for user {user_id}")
-            
             # Get user's active keywords
             keywords = UserKeyword.query.filter_by(
                 user_id=user_id,
@@ -364,144 +762,199 @@ class UserService:
             
             logger.info(f"Checking ads for user {user_id} with {len(keywords)} keywords")
             
+            # Single projected read: ad_id -> (db id, keyword_id, is_deleted), plus stored prices
+            known_ads = {}
+            stored_prices = {}  # ad_id -> (listing_id, price_value)
+            listing_of = {}  # ad_id -> listing_id
+            for row in db.session.query(
+                UserAd.id, UserAd.ad_id, UserAd.keyword_id, UserAd.is_deleted, UserAd.listing_id, Listing.price_value
+            ).outerjoin(Listing, UserAd.listing_id == Listing.id).filter(UserAd.user_id == user_id):
+                known_ads[row.ad_id] = (row.id, row.keyword_id, row.is_deleted)
+                stored_prices[row.ad_id] = (row.listing_id, row.price_value)
+                listing_of[row.ad_id] = row.listing_id
+            
+            # Keywords each ad matched in earlier checks: db id -> {keyword_id}
+            stored_links = {}
+            for row in db.session.query(UserAdKeyword.user_ad_id, UserAdKeyword.keyword_id).join(
+                UserAd, UserAdKeyword.user_ad_id == UserAd.id
+            ).filter(UserAd.user_id == user_id):
+                stored_links.setdefault(row.user_ad_id, set()).add(row.keyword_id)
+            
+            fresh_ads = {}  # ad_id -> (keyword_id, ad_data)
+            fresh_links = {}  # ad_id -> {keyword_id} for ads inserted by this check
+            matched = {}  # ad_id -> {keyword_id} for stored ads found in this check
+            resurrections = []
+            resurrected_ads = {}
+            price_changes = {}  # listing_id -> price update, only for prices that changed
+            checked_keyword_ids = []
+            current_time = datetime.utcnow()
+            
             for keyword_obj in keywords:
                 keyword = keyword_obj.keyword
                 
-                # Get current ads from scraper
+                # Get current ads, scraped once per canonical keyword for all users
                 try:
-                    current_ads = self.scraper.search(keyword)
+                    current_ads = self.search_keyword(keyword_obj.canonical or UserKeyword.canonicalize(keyword))
                     logger.info(f"Found {len(current_ads)} current ads for keyword '{keyword}'")
                 except Exception as e:
                     logger.error(f"Failed to scrape ads for keyword '{keyword}': {e}")
                     continue
                 
-                # Get existing ads for this keyword (including deleted ones for resurrection logic)
-                existing_ads = UserAd.query.filter_by(
-                    user_id=user_id,
-                    keyword_id=keyword_obj.id,
-                    is_deleted=False
-                ).all()
-                
-                # Also get deleted ads for this keyword to check for resurrection
-                deleted_ads_for_keyword = UserAd.query.filter_by(
-                    user_id=user_id,
-                    keyword_id=keyword_obj.id,
-                    is_deleted=True
-                ).all()
-                
-                existing_ad_ids = {ad.ad_id for ad in existing_ads}
-                current_ad_ids = {ad['id'] for ad in current_ads}
-                deleted_ad_ids_for_keyword = {ad.ad_id for ad in deleted_ads_for_keyword}
-                
-                # Find ads to resurrect (were deleted but found again)
-                resurrected_ad_ids = deleted_ad_ids_for_keyword & current_ad_ids
-                
-                # Resurrect deleted ads that are found again
-                for deleted_ad in deleted_ads_for_keyword:
-                    if deleted_ad.ad_id in resurrected_ad_ids:
-                        logger.info(f"Resurrecting ad {deleted_ad.ad_id} for keyword '{keyword}'")
-                        deleted_ad.is_deleted = False
-                        deleted_ad.is_new = True
-                        deleted_ad.marked_new_at = datetime.utcnow()
-                        deleted_ad.scraped_at = datetime.utcnow()
-                        
-                        # Update ad data with current scraper results
-                        current_ad_data = next((ad for ad in current_ads if ad['id'] == deleted_ad.ad_id), None)
-                        if current_ad_data:
-                            deleted_ad.title = current_ad_data.get('title', deleted_ad.title)
-                            deleted_ad.description = current_ad_data.get('description', deleted_ad.description)
-                            deleted_ad.price = current_ad_data.get('price', deleted_ad.price)
-                            deleted_ad.link = current_ad_data.get('link', deleted_ad.link)
-                            deleted_ad.image_url = current_ad_data.get('image_url', deleted_ad.image_url)
-                            deleted_ad.date_added = current_ad_data.get('date_added', deleted_ad.date_added)
-                            deleted_ad.date_added_parsed = UserAd.parse_czech_date(current_ad_data.get('date_added', ''))
-                        
-                        new_ads.append({
-                            'keyword': keyword,
-                            'ad': current_ad_data or deleted_ad.to_dict()
-                        })
-                
-                # Update existing_ad_ids to include resurrected ads
-                existing_ad_ids.update(resurrected_ad_ids)
+                current_by_id = {ad['id']: ad for ad in current_ads}
                 
-                # Find new ads (in current results but not in existing or resurrected)
-                new_ad_ids = current_ad_ids - existing_ad_ids
-                
-                for ad_data in current_ads:
-                    if ad_data['id'] in new_ad_ids:
-                        # Check if this ad already exists for this user (from other keywords)
-                        existing_user_ad = UserAd.query.filter_by(
-                            user_id=user_id,
-                            ad_id=ad_data['id']
-                        ).first()
-                        
-                        if existing_user_ad:
-                            # Ad exists for another keyword, skip creating duplicate
-                            continue
-                            
-                        
-                        # Save new ad
-                        date_added_str = ad_data.get('date_added', '')
-                        current_time = datetime.utcnow()
-                        user_ad = UserAd(
-                            user_id=user_id,
-                            keyword_id=keyword_obj.id,
-                            ad_id=ad_data['id'],
-                            title=ad_data.get('title', ''),
-                            description=ad_data.get('description', ''),
-                            price=ad_data.get('price', ''),
-                            location=ad_data.get('location', ''),
-                            seller_name=ad_data.get('seller_name', ''),
-                            link=ad_data.get('link', ''),
-                            image_url=ad_data.get('image_url', ''),
-                            date_added=date_added_str,
-                            date_added_parsed=UserAd.parse_czech_date(date_added_str),
-                            scraped_at=current_time,
-                            is_new=True,
-                            marked_new_at=current_time
-                        )
-                        db.session.add(user_ad)
-                        new_ads.append({
-                            'keyword': keyword,
-                            'ad': ad_data
-                        })
-                
-                # Find deleted ads (active ads that are no longer in current results)
-                deleted_ad_ids = existing_ad_ids - current_ad_ids
-                for ad in existing_ads:
-                    if ad.ad_id in deleted_ad_ids:
-                        logger.info(f"Marking ad {ad.ad_id} as deleted for keyword '{keyword}'")
-                        ad.is_deleted = True
-                        deleted_ads.append({
-                            'keyword': keyword,
-                            'ad': ad.to_dict()
-                        })
+                for ad_id, ad_data in current_by_id.items():
+                    if ad_id in fresh_ads:
+                        # Already found by an earlier keyword of this check
+                        fresh_links[ad_id].add(keyword_obj.id)
+                        continue
+                    
+                    known = known_ads.get(ad_id)
+                    if known is None:
+                        # Brand new for this user
+                        fresh_ads[ad_id] = (keyword_obj.id, ad_data)
+                        fresh_links[ad_id] = {keyword_obj.id}
+                        new_ads.append({'keyword': keyword, 'ad': ad_data})
+                        continue
+                    
+                    matched.setdefault(ad_id, set()).add(keyword_obj.id)
+                    db_id, keyword_id, is_deleted = known
+                    if not is_deleted:
+                        # Already active - compared against the stored price in memory, written only on change
+                        listing_id, stored_value = stored_prices.get(ad_id, (None, None))
+                        change = self._price_change(listing_id, ad_data.get('price', ''), stored_value) if listing_id else None
+                        if change:
+                            price_changes[listing_id] = change
+                        continue
+                    
+                    # Deleted ad found again - resurrect it under this keyword, its listing gets the fresh data
+                    logger.info(f"Resurrecting ad {ad_id} for keyword '{keyword}'")
+                    resurrections.append({
+                        'id': db_id,
+                        'keyword_id': keyword_obj.id,
+                        'is_deleted': False,
+                        'deleted_at': None,
+                        'is_new': True,
+                        'marked_new_at': current_time,
+                        'scraped_at': current_time,
+                        'date_added_parsed': UserAd.parse_czech_date(ad_data.get('date_added', ''))
+                    })
+                    resurrected_ads[ad_id] = ad_data
+                    known_ads[ad_id] = (db_id, keyword_obj.id, False)
+                    stored_prices.pop(ad_id, None)  # Its price is recorded with the listing refresh
+                    new_ads.append({'keyword': keyword, 'ad': ad_data})
                 
                 # Update keyword last checked
-                keyword_obj.last_checked = datetime.utcnow()
+                checked_keyword_ids.append(keyword_obj.id)
+            
+            # Reconcile stored ads with the keywords that matched them: an ad is deleted only
+            # once none of its keywords finds it, keywords that failed to scrape keep their links
+            checked = set(checked_keyword_ids)
+            keyword_names = {keyword_obj.id: keyword_obj.keyword for keyword_obj in keywords}
+            added_links = []
+            dropped_links = {}  # keyword_id -> [db id]
+            regrouped = []
+            deletions = []
+            missing_listing_ids = []
+            for ad_id, (db_id, keyword_id, is_deleted) in known_ads.items():
+                links = stored_links.get(db_id, set())
+                found_by = matched.get(ad_id, set())
+                added_links.extend({'user_ad_id': db_id, 'keyword_id': kw_id} for kw_id in found_by - links)
+                for kw_id in (links & checked) - found_by:
+                    dropped_links.setdefault(kw_id, []).append(db_id)
+                
+                if is_deleted:
+                    continue
+                # Ads stored before links existed count as linked to the keyword they are shown under
+                remaining = ((links or {keyword_id}) - checked) | found_by
+                if not remaining:
+                    logger.info(f"Marking ad {ad_id} as deleted for keyword '{keyword_names.get(keyword_id)}'")
+                    deletions.append(db_id)
+                    missing_listing_ids.append(listing_of.get(ad_id))
+                    deleted_ads.append({
+                        'keyword': keyword_names.get(keyword_id),
+                        'ad': {'id': ad_id, 'db_id': db_id, 'is_deleted': True}
+                    })
+                elif keyword_id not in remaining:
+                    # The keyword it was shown under stopped matching, another one still does
+                    regrouped.append({'id': db_id, 'keyword_id': min(remaining)})
+            
+            check_duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
             
-            # Commit with retry mechanism
-            def _commit_changes():
-                db.session.commit()
-                return True
+            # Lifecycle of the listings behind the stored ads this check did or did not find
+            seen_listing_ids = {listing_of[ad_id] for ad_id in matched if listing_of.get(ad_id)}
+            missing_listing_ids = [listing_id for listing_id in missing_listing_ids if listing_id]
+            
+            # One batched write for the whole user
+            def _apply_changes():
+                # The writer reruns this when its batch fails - extend copies, never the captured state
+                new_links = list(added_links)
+                seen_ids = set(seen_listing_ids)
+                if fresh_ads:
+                    listing_ids = self._ensure_listings({ad_id: ad_data for ad_id, (_, ad_data) in fresh_ads.items()})
+                    seen_ids.update(listing_ids.values())
+                    db.session.execute(insert(UserAd), [
+                        self._new_ad_row(user_id, keyword_id, listing_ids[ad_id], ad_data, current_time)
+                        for ad_id, (keyword_id, ad_data) in fresh_ads.items()
+                    ])
+                    inserted = db.session.query(UserAd.ad_id, UserAd.id).filter(
+                        UserAd.user_id == user_id,
+                        UserAd.ad_id.in_(list(fresh_ads))
+                    )
+                    new_links.extend(
+                        {'user_ad_id': row.id, 'keyword_id': kw_id}
+                        for row in inserted
+                        for kw_id in fresh_links[row.ad_id]
+                    )
+                if resurrections:
+                    self._ensure_listings(resurrected_ads, refresh=True)
+                    db.session.execute(update(UserAd), resurrections)
+                if regrouped:
+                    db.session.execute(update(UserAd), regrouped)
+                if deletions:
+                    db.session.execute(
+                        update(UserAd)
+                        .where(UserAd.id.in_(deletions))
+                        .values(is_deleted=True, deleted_at=current_time)
+                        .execution_options(synchronize_session=False)
+                    )
+                for kw_id, db_ids in dropped_links.items():
+                    db.session.execute(
+                        delete(UserAdKeyword)
+                        .where(UserAdKeyword.keyword_id == kw_id, UserAdKeyword.user_ad_id.in_(db_ids))
+                        .execution_options(synchronize_session=False)
+                    )
+                if new_links:
+                    db.session.execute(insert(UserAdKeyword), [dict(link, created_at=current_time) for link in new_links])
+                if price_changes:
+                    self._record_price_changes(list(price_changes.values()), current_time)
+                self._mark_listings_seen(list(seen_ids), current_time)
+                self._mark_listings_missing(missing_listing_ids, current_time)
+                # Check stats ride along in the same transaction instead of a commit of their own
+                UserStats.record_check(
+                    user_id,
+                    check_duration_ms=check_duration_ms,
+                    ads_found=len(new_ads),
+                    ads_deleted=len(deleted_ads),
+                    ads=len(fresh_ads) + len(resurrections) - len(deletions),
+                    changed=bool(fresh_ads or resurrections or regrouped or deletions or dropped_links or new_links or price_changes)
+                )
+                if checked_keyword_ids:
+                    db.session.execute(
+                        update(UserKeyword)
+                        .where(UserKeyword.id.in_(checked_keyword_ids))
+                        .values(last_checked=current_time)
+                        .execution_options(synchronize_session=False)
+                    )
             
+            # Hand the write to the single writer, the scrape above held no locks
             try:
-                retry_db_operation(_commit_changes)
-                logger.info(f"Successfully committed {len(new_ads)} new ads and {len(deleted_ads)} deleted ads for user {user_id}")
+                db_writer.run(_apply_changes)
+                logger.info(f"Successfully committed {len(new_ads)} new ads, {len(deleted_ads)} deleted ads and {len(price_changes)} price changes for user {user_id}")
             except Exception as commit_error:
                 logger.error(f"Failed to commit changes for user {user_id}: {commit_error}")
                 db.session.rollback()
                 raise commit_error
             
-            # Update user stats
-            check_duration_ms = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-            self.update_user_stats(
-                user_id=user_id,
-                check_duration_ms=check_duration_ms,
-                ads_found=len(new_ads),
-                ads_deleted=len(deleted_ads)
-            )
-            
             logger.info(f"Check completed for user {user_id}: {len(new_ads)} new ads, {len(deleted_ads)} deleted ads")
             return True, new_ads, deleted_ads
             
@@ -11,7 +11,7 @@ import logging
 import re
 from datetime import datetime
 from typing import List, Dict, Optional
-from urllib.parse import urljoin
+from urllib.parse import quote_plus, urljoin
 
 class BazosScraper:
     """
@@ -107,7 +107,7 @@ class BazosScraper:
             # Construct search URL using the correct format that works with Bazos.cz
             # Bazos uses 'crz' parameter for pagination: crz=0 (page 1), crz=20 (page 2), crz=40 (page 3), etc.
             crz_value = page * 20  # page is 0-based, so page 0 -> crz=0, page 1 -> crz=20, etc.
-            url = f"{self.base_url}/search.php?hledat={keyword}&hlokalita=&humkreis=25&cenaod=&cenado=&order=&crz={crz_value}&rz=0"
+            url = f"{self.base_url}/search.php?hledat={quote_plus(keyword)}&hlokalita=&humkreis=25&cenaod=&cenado=&order=&crz={crz_value}&rz=0"
             
             self.logger.debug(f"Requesting URL: {url}")
             response = self._make_request(url)
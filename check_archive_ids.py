@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Regression check for ad ids across user_ads and archived_user_ads
+archived_user_ads keeps the original user_ads.id, so SQLite must never hand that id out again.
+Archives an ad, stores a new one and archives that too, on a fresh schema and on a legacy
+schema (plain INTEGER PRIMARY KEY with an id already reused) upgraded by run_migrations.
+Then asks /api/user/ads for include_archived=true alone and checks every Bazos ad is listed
+once, also when it reappeared after being archived or was archived twice.
+Runs against throwaway SQLite databases: python check_archive_ids.py
+"""
+
+import os
+import sys
+import tempfile
+import importlib.util
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import func, select, text
+from sqlalchemy.schema import CreateTable
+from app.models import db, ArchivedUserAd, Listing, User, UserAd, UserKeyword
+from app.maintenance import archive_deleted_ads
+from app.migrations import run_migrations
+
+def create_app(database_path):
+    """Flask app bound to a scratch SQLite database"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def use_legacy_user_ads():
+    """Recreate user_ads the way databases created before AUTOINCREMENT have it"""
+    with db.engine.begin() as conn:
+        table_sql = str(CreateTable(UserAd.__table__).compile(conn)).replace(' AUTOINCREMENT', '')
+        conn.execute(text('DROP TABLE user_ads'))
+        conn.execute(text(table_sql))
+
+def add_ad(user, keyword, listing, ad_id, deleted):
+    """Store an ad, deleted ads are old enough to be archived"""
+    ad = UserAd(
+        user_id=user.id, keyword_id=keyword.id, ad_id=ad_id, listing_id=listing.id,
+        is_deleted=deleted, deleted_at=datetime.utcnow() - timedelta(days=30) if deleted else None
+    )
+    db.session.add(ad)
+    db.session.commit()
+    return ad.id
+
+def run_scenario(legacy):
+    """Archive, re-insert and archive again, returns a list of failures"""
+    user = User(username='archive-check', email='archive-check@example.com', password_hash='-')
+    db.session.add(user)
+    db.session.commit()
+    keyword = UserKeyword(user_id=user.id, keyword='archive check')
+    listing = Listing(ad_id='archive-check', title='Archive check')
+    db.session.add_all([keyword, listing])
+    db.session.commit()
+
+    add_ad(user, keyword, listing, '1', deleted=False)
+    add_ad(user, keyword, listing, '2', deleted=True)
+    archive_deleted_ads(pause=0)
+    add_ad(user, keyword, listing, '3', deleted=True)
+
+    if legacy:
+        # The legacy table already handed the archived id out again, the upgrade must repair it
+        run_migrations()
+
+    failures = []
+    try:
+        archive_deleted_ads(pause=0)
+    except Exception as e:
+        db.session.rollback()
+        failures.append(f"second archive failed: {e.__class__.__name__}: {str(e).splitlines()[0]}")
+
+    archived = db.session.scalar(select(func.count()).select_from(ArchivedUserAd))
+    if archived != 2:
+        failures.append(f"expected 2 archived ads, found {archived}")
+
+    shared = db.session.scalars(select(UserAd.id).where(UserAd.id.in_(select(ArchivedUserAd.id)))).all()
+    if shared:
+        failures.append(f"live ads share ids with archived ads: {shared}")
+
+    return failures
+
+def load_main_app(directory):
+    """Load app.py the way scheduler.py does, with its database and data/ files in directory"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'feed.db')}"
+    # The JSON backend only writes when counters change, so nothing lands in the real data/
+    os.environ['STATS_BACKEND'] = 'json'
+    os.makedirs(os.path.join(directory, 'data'))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        spec = importlib.util.spec_from_file_location("main_app", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"))
+        main_app = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(main_app)
+    finally:
+        os.chdir(cwd)
+    return main_app
+
+def run_feed_scenario(main_app):
+    """Archive, reappear and archive twice, then read the feed over HTTP, returns a list of failures"""
+    from flask_jwt_extended import create_access_token
+
+    with main_app.app.app_context():
+        user = User(username='feed-check', email='feed-check@example.com', password_hash='-')
+        db.session.add(user)
+        db.session.commit()
+        keyword = UserKeyword(user_id=user.id, keyword='feed check')
+        listing = Listing(ad_id='feed-check', title='Feed check')
+        db.session.add_all([keyword, listing])
+        db.session.commit()
+
+        add_ad(user, keyword, listing, 'live', deleted=False)
+        for ad_id in ('archived', 'reappeared', 'archived twice'):
+            add_ad(user, keyword, listing, ad_id, deleted=True)
+        archive_deleted_ads(pause=0)
+        add_ad(user, keyword, listing, 'reappeared', deleted=False)
+        add_ad(user, keyword, listing, 'archived twice', deleted=True)
+        archive_deleted_ads(pause=0)
+        headers = {'Authorization': f"Bearer {create_access_token(identity=str(user.id))}"}
+        db.session.remove()
+
+    expected = {
+        '/api/user/ads': {'live': False, 'reappeared': False},
+        '/api/user/ads?include_archived=true': {
+            'live': False, 'reappeared': False, 'archived': True, 'archived twice': True
+        },
+    }
+    failures = []
+    client = main_app.app.test_client()
+    for url, expected_ads in expected.items():
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            failures.append(f"{url}: HTTP {response.status_code}")
+            continue
+        ads = response.get_json()['ads']
+        ids = [ad['id'] for ad in ads]
+        if len(ids) != len(set(ids)):
+            failures.append(f"{url}: duplicate ids {sorted(ids)}")
+        found = {ad['id']: ad.get('is_archived', False) for ad in ads}
+        if found != expected_ads:
+            failures.append(f"{url}: expected {expected_ads}, got {found}")
+    return failures
+
+def check_archived_feed():
+    """Run the feed scenario against app.py on a scratch database"""
+    with tempfile.TemporaryDirectory() as directory:
+        main_app = load_main_app(directory)
+        failures = run_feed_scenario(main_app)
+        with main_app.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+    if failures:
+        print("❌ /api/user/ads with include_archived:")
+        for failure in failures:
+            print(f"   {failure}")
+        return False
+    print("✅ /api/user/ads with include_archived: every ad listed once")
+    return True
+
+def check_archive_ids():
+    """Run every scenario on its own scratch database"""
+    print("🔍 Checking that archived ad ids are never reused")
+    print("=" * 40)
+
+    all_passed = True
+    for name, legacy in (('fresh schema', False), ('legacy schema upgraded', True)):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app(os.path.join(directory, 'check.db'))
+            with app.app_context():
+                db.create_all()
+                if legacy:
+                    use_legacy_user_ads()
+                else:
+                    run_migrations()
+                failures = run_scenario(legacy)
+                db.session.remove()
+                db.engine.dispose()
+
+        if failures:
+            all_passed = False
+            print(f"❌ {name}:")
+            for failure in failures:
+                print(f"   {failure}")
+        else:
+            print(f"✅ {name}: archive, re-insert and archive again")
+
+    if not check_archived_feed():
+        all_passed = False
+
+    print("=" * 40)
+    return all_passed
+
+if __name__ == '__main__':
+    if check_archive_ids():
+        print("🎉 Archived ad ids stay unique and every ad is listed once")
+        sys.exit(0)
+    print("💥 Archived ad ids are reused or ads are listed twice")
+    sys.exit(1)
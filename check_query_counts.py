@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Statement-count regression check for the user list endpoints
+Ad and favorite lists eager-load their listing, keyword and ad, so a page costs a fixed
+number of queries however many rows it holds. Counts the statements each call issues
+against a throwaway SQLite database seeded with ads and favorites.
+Run this after changing what to_dict reads: python check_query_counts.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event
+from app.models import db, Listing, User, UserAd, UserAdKeyword, UserFavorite, UserKeyword, UserStats
+from app.migrations import run_migrations
+from app.user_service import UserService
+
+ADS = 60
+FAVORITES = 15
+
+def create_app(database_path):
+    """Flask app bound to a scratch SQLite database"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed():
+    """One user with ADS ads over two keywords, FAVORITES of them favorited"""
+    user = User(username='query-count', email='query-count@example.com', password_hash='-')
+    db.session.add(user)
+    db.session.commit()
+    keywords = [UserKeyword(user_id=user.id, keyword=keyword) for keyword in ('pioneer', 'technics')]
+    db.session.add_all(keywords)
+    db.session.add(UserStats(user_id=user.id))
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for i in range(ADS):
+        keyword = keywords[i % len(keywords)]
+        listing = Listing(ad_id=str(i), title=f'Ad {i}', price='100 Kč', created_at=now)
+        db.session.add(listing)
+        db.session.flush()
+        ad = UserAd(
+            user_id=user.id, keyword_id=keyword.id, ad_id=str(i), listing_id=listing.id,
+            date_added_parsed=now - timedelta(hours=i), scraped_at=now
+        )
+        db.session.add(ad)
+        db.session.flush()
+        db.session.add(UserAdKeyword(user_ad_id=ad.id, keyword_id=keyword.id))
+        if i < FAVORITES:
+            db.session.add(UserFavorite(user_id=user.id, ad_id=ad.id))
+    db.session.commit()
+    return user.id
+
+def query_budgets(user_id):
+    """(name, call, rows the call must return, statements allowed)"""
+    service = UserService()
+    return [
+        (
+            'get_user_ads_page (/api/user/ads, /api/user/recent-ads)',
+            lambda: service.get_user_ads_page(user_id, limit=ADS)[0],
+            ADS, 1
+        ),
+        (
+            'get_user_favorites (/api/user/favorites)',
+            lambda: service.get_user_favorites(user_id),
+            FAVORITES, 1
+        ),
+        (
+            'User.to_dict (/api/auth/me)',
+            lambda: [db.session.get(User, user_id).to_dict()],
+            1, 2
+        ),
+    ]
+
+def count_statements(call):
+    """Run call() on an empty session, returns (result, statements executed)"""
+    db.session.remove()
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _count)
+    try:
+        result = call()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _count)
+        db.session.rollback()
+    return result, statements
+
+def check_query_counts():
+    """Run every call and check its statement count against the budget"""
+    print("🔍 Checking statements per request for user list endpoints")
+    print("=" * 40)
+
+    all_passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(os.path.join(directory, 'check.db'))
+        with app.app_context():
+            db.create_all()
+            run_migrations()
+            user_id = seed()
+
+            for name, call, expected_rows, budget in query_budgets(user_id):
+                result, statements = count_statements(call)
+                if len(result) != expected_rows:
+                    all_passed = False
+                    print(f"❌ {name}: returned {len(result)} rows, expected {expected_rows}")
+                elif len(statements) != budget:
+                    all_passed = False
+                    print(f"❌ {name}: {len(statements)} statements for {expected_rows} rows, expected {budget}")
+                    for statement in statements:
+                        print(f"   {' '.join(statement.split())[:120]}")
+                else:
+                    print(f"✅ {name}: {len(statements)} statement(s) for {expected_rows} rows")
+
+            db.session.remove()
+            db.engine.dispose()
+
+    print("=" * 40)
+    return all_passed
+
+if __name__ == '__main__':
+    if check_query_counts():
+        print("🎉 Every list endpoint stays within its statement budget")
+        sys.exit(0)
+    print("💥 Some list endpoints issue more statements than expected")
+    sys.exit(1)
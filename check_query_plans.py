@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN-based regression check for the hot user_ads query shapes
+Verifies that every endpoint's query is planned against one of its dedicated indexes.
+Run this after schema or query changes: python check_query_plans.py
+"""
+
+import sys
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from init_db import create_app
+from sqlalchemy import or_
+from app.models import db, UserAd, UserSession
+from app.search import matching_listing_ids
+from app.migrations import run_migrations
+from app.user_service import UserService
+
+def hot_queries():
+    """(name, query, acceptable indexes) for each hot query shape"""
+    return [
+        (
+            'get_user_ads_page (/api/user/recent-ads, /api/user/ads)',
+            UserService.recent_ads_query(user_id=1),
+            {'ix_user_ads_active_feed', 'ix_user_ads_feed'}
+        ),
+        (
+            'per-keyword ads (remove_user_keyword)',
+            UserAd.query.filter_by(user_id=1, keyword_id=1, is_deleted=False),
+            {'ix_user_ads_user_keyword'}
+        ),
+        (
+            'currently NEW ads (UserAd.is_currently_new)',
+            UserAd.query.filter(UserAd.is_currently_new),
+            {'ix_user_ads_new_partial', 'ix_user_ads_new_marked'}
+        ),
+        (
+            'ad search (/api/user/ads/search)',
+            UserService.recent_ads_query(user_id=1).filter(UserAd.listing_id.in_(matching_listing_ids('skoda octavia'))),
+            {'ix_listings_search', 'listings_fts'}
+        ),
+        (
+            'expired session purge (purge_expired_sessions)',
+            UserSession.query.filter(or_(UserSession.expires_at < datetime.utcnow(), UserSession.is_active == False)),
+            {'ix_user_sessions_expires_at'}
+        ),
+    ]
+
+def explain(query):
+    """Return the database's query plan for an ORM query as text"""
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if db.engine.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    if db.engine.dialect.name == 'postgresql':
+        # Tiny development tables would otherwise always be sequentially scanned
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", params).fetchall()
+    return '\n'.join(str(row[0]) for row in rows)
+
+def check_query_plans():
+    """Explain every hot query and check that it uses its index"""
+    print("🔍 Checking query plans for hot user_ads queries")
+    print("=" * 40)
+
+    failures = 0
+    for name, query, expected_indexes in hot_queries():
+        plan = explain(query)
+        used = sorted(index for index in expected_indexes if index in plan)
+        if used:
+            print(f"✅ {name}: uses {', '.join(used)}")
+        else:
+            failures += 1
+            print(f"❌ {name}: expected one of {', '.join(sorted(expected_indexes))}")
+            print(f"   Plan:\n   " + plan.replace('\n', '\n   '))
+
+    db.session.rollback()
+    print("=" * 40)
+    return failures == 0
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+        success = check_query_plans()
+
+    if success:
+        print("🎉 All hot queries use their indexes")
+        sys.exit(0)
+    print("💥 Some hot queries are not using their indexes")
+    sys.exit(1)
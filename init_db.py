@@ -7,6 +7,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from app.models import db, User, UserKeyword, UserAd, UserFavorite, UserStats, UserSession
+from app.migrations import run_migrations
 
 def setup_postgresql_support():
     """Setup PostgreSQL support before database initialization"""
@@ -111,6 +112,7 @@ def init_database():
         try:
             # Create all tables
             db.create_all()
+            run_migrations()
             print("✅ Database tables created successfully")
             
             # Create data directory if it doesn't exist
@@ -66,9 +66,6 @@ def main():
         app = main_app.app
         socketio = main_app.socketio
         
-        # Clean up old NEW tags on startup
-        main_app.cleanup_old_new_tags_on_startup()
-        
         print(f"🌐 Starting Flask app on http://{host}:{port}")
         
         # Start the Flask app
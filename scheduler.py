@@ -10,7 +10,7 @@ import time
 import json
 import signal
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Add the project root to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -24,8 +24,14 @@ spec = importlib.util.spec_from_file_location("main_app", os.path.join(os.path.d
 main_app = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(main_app)
 
-from app.models import db, User, UserKeyword, UserAd, UserFavorite
+from app.models import db, User, UserKeyword
 from app.user_service import UserService
+from app.migrations import run_migrations
+from app.db_writer import db_writer
+from app.maintenance import (
+    purge_deleted_ads, archive_deleted_ads, purge_archived_ads, purge_expired_sessions, table_stats,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_RETENTION_DAYS
+)
 
 # Configure logging
 logging.basicConfig(
@@ -50,10 +56,12 @@ class AdScheduler:
         
         # Initialize the database with the app
         db.init_app(self.app)
+        db_writer.init_app(self.app)
         
         with self.app.app_context():
             # Ensure the database is initialized
             db.create_all()
+            run_migrations()
             logger.info("✅ Database tables initialized")
         
         # Store app context for database operations
@@ -82,32 +90,23 @@ class AdScheduler:
         logger.info(f"Scheduler initialized with {self.check_interval}s interval")
 
     def test_stats_file_access(self):
-        """Test if we can read and write to the stats file"""
+        """Test if we can read and write the stats backend"""
         try:
-            logger.info("🔍 Testing stats file access...")
+            logger.info(f"🔍 Testing stats access ({type(self.stats.backend).__name__})...")
             
             # Test read access
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8-sig') as f:
-                    stats_data = json.load(f)
-                logger.info(f"✅ Stats file read successful. Current total checks: {stats_data.get('checks', {}).get('total', 0)}")
-            else:
-                logger.info("Stats file doesn't exist yet - will be created")
+            self.stats.reload_stats_from_file()
+            logger.info(f"✅ Stats read successful. Current total checks: {self.stats.stats['checks']['total']}")
             
             # Test write access by recording a test event
             test_start_time = time.time()
             self.stats.record_system_start()
+            self.stats.flush()
             test_duration = int((time.time() - test_start_time) * 1000)
-            logger.info(f"✅ Stats write test successful (took {test_duration}ms)")
-            
-            # Verify the write by reading back
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8-sig') as f:
-                    updated_stats = json.load(f)
-                logger.info(f"✅ Stats write verification successful. Restarts: {updated_stats.get('system', {}).get('restarts', 0)}")
+            logger.info(f"✅ Stats write test successful (took {test_duration}ms). Restarts: {self.stats.stats['system']['restarts']}")
             
         except Exception as e:
-            logger.error(f"❌ Stats file access test failed: {e}")
+            logger.error(f"❌ Stats access test failed: {e}")
             logger.error(f"Stats file path: {os.path.abspath(self.stats_file)}")
             logger.error(f"Data directory exists: {os.path.exists('data')}")
             logger.error(f"Data directory permissions: {oct(os.stat('data').st_mode)[-3:] if os.path.exists('data') else 'N/A'}")
@@ -117,9 +116,6 @@ class AdScheduler:
         try:
             logger.info(f"🔧 Recording check with duration: {duration_ms}ms")
             
-            # Force reload stats from file to get latest data from other processes
-            self.stats.reload_stats_from_file()
-            
             # Get current stats before update
             current_total = self.stats.stats.get("checks", {}).get("total", 0)
             
@@ -131,18 +127,6 @@ class AdScheduler:
             
             if new_total > current_total:
                 logger.info(f"✅ Check recorded successfully. Total checks: {current_total} → {new_total}")
-                
-                # Double-check by reading from file
-                try:
-                    with open(self.stats_file, 'r', encoding='utf-8-sig') as f:
-                        file_stats = json.load(f)
-                    file_total = file_stats.get("checks", {}).get("total", 0)
-                    if file_total == new_total:
-                        logger.info(f"✅ Stats file verification successful. File shows {file_total} checks")
-                    else:
-                        logger.warning(f"⚠️  Stats file mismatch. Memory: {new_total}, File: {file_total}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to verify stats file after check recording: {e}")
             else:
                 logger.error(f"❌ Check recording failed. Total unchanged: {current_total}")
                 
@@ -157,9 +141,6 @@ class AdScheduler:
         try:
             logger.info(f"📊 Recording {count} ads found for keyword '{keyword}'")
             
-            # Force reload stats from file to get latest data from other processes
-            self.stats.reload_stats_from_file()
-            
             # Get current stats before update
             current_total = self.stats.stats.get("ads", {}).get("total_found", 0)
             current_keyword_stats = self.stats.stats.get("ads", {}).get("by_keyword", {}).get(keyword, {})
@@ -176,18 +157,6 @@ class AdScheduler:
             if new_keyword_found > current_keyword_found:
                 logger.info(f"✅ Ads recorded successfully for '{keyword}': {current_keyword_found} → {new_keyword_found}")
                 logger.info(f"✅ Total ads updated: {current_total} → {new_total}")
-                
-                # Double-check by reading from file
-                try:
-                    with open(self.stats_file, 'r', encoding='utf-8-sig') as f:
-                        file_stats = json.load(f)
-                    file_keyword_found = file_stats.get("ads", {}).get("by_keyword", {}).get(keyword, {}).get("found", 0)
-                    if file_keyword_found == new_keyword_found:
-                        logger.info(f"✅ Stats file verification successful for '{keyword}': {file_keyword_found} ads")
-                    else:
-                        logger.warning(f"⚠️  Stats file mismatch for '{keyword}'. Memory: {new_keyword_found}, File: {file_keyword_found}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to verify stats file for '{keyword}': {e}")
             else:
                 logger.error(f"❌ Ads recording failed for '{keyword}'. Count unchanged: {current_keyword_found}")
                 
@@ -270,13 +239,7 @@ class AdScheduler:
         try:
             # Ensure we're in the application context for database operations
             with self.app.app_context():
-                # Get all active users
-                users = User.query.filter_by(is_active=True).all()
-            
-                if not users:
-                    logger.info("No active users to check")
-                    return
-                
+                users_checked = 0
                 total_new_ads = 0
                 total_deleted_ads = 0
                 total_users_with_changes = 0
@@ -284,9 +247,9 @@ class AdScheduler:
                 # Track performance
                 start_time = time.time()
                 
-                logger.info(f"Checking ads for {len(users)} active users")
-                
-                for user in users:
+                # Stream active users with keywords in bounded batches, memory stays flat as users grow
+                for user in self.user_service.iter_users_to_check():
+                    users_checked += 1
                     try:
                         # Check ads for this user using UserService
                         success, new_ads, deleted_ads = self.user_service.check_user_ads(user.id)
@@ -309,11 +272,15 @@ class AdScheduler:
                         logger.error(f"Error checking ads for user {user.username}: {e}")
                         continue
                 
+                if not users_checked:
+                    logger.info("No active users to check")
+                    return
+                
                 # Record check duration with enhanced logging
                 check_duration_ms = int((time.time() - start_time) * 1000)
                 self.safe_record_check(check_duration_ms)
                 
-                logger.info(f"Check completed in {check_duration_ms}ms. Total: {total_new_ads} new ads, {total_deleted_ads} deleted ads across {total_users_with_changes} users")
+                logger.info(f"Check completed in {check_duration_ms}ms. Total: {total_new_ads} new ads, {total_deleted_ads} deleted ads across {total_users_with_changes} of {users_checked} users")
                 
                 # Note: Individual user notifications are handled by the UserService
                 # The web app reads directly from the database, so no file-based notifications needed
@@ -423,29 +390,24 @@ class AdScheduler:
         except Exception as e:
             logger.error(f"Error in ad check: {e}")
 
-    def cleanup_old_new_tags(self):
-        """Clean up old NEW tags from the database"""
+    def archive_old_deleted_ads(self):
+        """Move long-deleted ads into the archive and drop archived ads past retention"""
         try:
             with self.app.app_context():
-                from datetime import datetime, timedelta, timezone
-                
-                # Clear "NEW" tags from ads older than 6 hours
-                # Use timezone-naive comparison since database stores timezone-naive datetimes
-                six_hours_ago = datetime.utcnow() - timedelta(hours=6)
+                archived = archive_deleted_ads()
+                if archived.rows:
+                    logger.info(f"Archived {archived.rows} ads deleted more than {ARCHIVE_AFTER_DAYS} days ago "
+                                f"({archived.batches} batches, {archived.duration_s:.1f}s, {archived.rows_per_second} rows/s)")
+                else:
+                    logger.info("No deleted ads to archive")
                 
-                updated_count = UserAd.query.filter(
-                    UserAd.is_new == True,
-                    UserAd.marked_new_at < six_hours_ago
-                ).update({'is_new': False})
+                expired = purge_archived_ads()
+                if expired.rows:
+                    logger.info(f"Dropped {expired.rows} archived ads older than {ARCHIVE_RETENTION_DAYS} days "
+                                f"({expired.rows_per_second} rows/s)")
                 
-                if updated_count > 0:
-                    db.session.commit()
-                    logger.info(f"Cleaned up NEW tags from {updated_count} ads older than 6 hours")
-                else:
-                    logger.info("✅ No old NEW tags to clean up")
-            
         except Exception as e:
-            logger.error(f"Error cleaning up old NEW tags: {e}")
+            logger.error(f"Error archiving old deleted ads: {e}")
             with self.app.app_context():
                 db.session.rollback()
 
@@ -453,30 +415,11 @@ class AdScheduler:
         """Permanently remove ads that have been marked as deleted for more than 30 days"""
         try:
             with self.app.app_context():
-                from datetime import datetime, timedelta, timezone
-                
-                # Remove ads that have been deleted for more than 30 days
-                thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+                result = purge_deleted_ads(older_than_days=30)
                 
-                # Find ads marked as deleted for more than 30 days
-                old_deleted_ads = UserAd.query.filter(
-                    UserAd.is_deleted == True,
-                    UserAd.scraped_at < thirty_days_ago  # Using scraped_at as we don't have deleted_at
-                ).all()
-                
-                if old_deleted_ads:
-                    count = len(old_deleted_ads)
-                    
-                    # Remove associated favorites first (to maintain foreign key integrity)
-                    for ad in old_deleted_ads:
-                        UserFavorite.query.filter_by(ad_id=ad.id).delete()
-                    
-                    # Remove the ads
-                    for ad in old_deleted_ads:
-                        db.session.delete(ad)
-                    
-                    db.session.commit()
-                    logger.info(f"Permanently removed {count} ads that were deleted more than 30 days ago")
+                if result.rows:
+                    logger.info(f"Permanently removed {result.rows} ads that were deleted more than 30 days ago "
+                                f"({result.batches} batches, {result.duration_s:.1f}s, {result.rows_per_second} rows/s)")
                 else:
                     logger.info("No old deleted ads to clean up")
                 
@@ -485,6 +428,23 @@ class AdScheduler:
             with self.app.app_context():
                 db.session.rollback()
 
+    def cleanup_expired_sessions(self):
+        """Drop expired and logged out login sessions"""
+        try:
+            with self.app.app_context():
+                result = purge_expired_sessions()
+                rows, size_bytes = table_stats('user_sessions')
+                size = f"{size_bytes / 1024:.0f} KiB" if size_bytes is not None else "size unknown"
+                
+                logger.info(f"Removed {result.rows} expired sessions ({result.batches} batches, "
+                            f"{result.duration_s:.1f}s, {result.rows_per_second} rows/s), "
+                            f"user_sessions now {rows} rows, {size}")
+                
+        except Exception as e:
+            logger.error(f"Error cleaning up expired sessions: {e}")
+            with self.app.app_context():
+                db.session.rollback()
+
     def run(self):
         """Main scheduler loop"""
         logger.info("Starting scheduler loop...")
@@ -496,8 +456,8 @@ class AdScheduler:
         # Individual user stats are managed by UserService
         
         next_check = time.time()
-        next_cleanup = time.time() + 3600  # First cleanup in 1 hour
         next_deleted_cleanup = time.time() + 86400  # First deleted ads cleanup in 24 hours
+        next_session_cleanup = time.time()  # Expired sessions are purged hourly, starting now
         
         while self.running:
             try:
@@ -508,16 +468,16 @@ class AdScheduler:
                     next_check = current_time + self.check_interval
                     logger.info(f"Next check scheduled in {self.check_interval} seconds")
                 
-                # Run NEW tag cleanup every hour
-                if current_time >= next_cleanup:
-                    self.cleanup_old_new_tags()
-                    next_cleanup = current_time + 3600  # Next cleanup in 1 hour
-                
-                # Run deleted ads cleanup once per day
+                # Run deleted ads archiving and cleanup once per day
                 if current_time >= next_deleted_cleanup:
+                    self.archive_old_deleted_ads()
                     self.cleanup_old_deleted_ads()
                     next_deleted_cleanup = current_time + 86400  # Next cleanup in 24 hours
                 
+                if current_time >= next_session_cleanup:
+                    self.cleanup_expired_sessions()
+                    next_session_cleanup = current_time + 3600
+                
                 # Sleep for 1 second to avoid busy waiting
                 time.sleep(1)
                 
@@ -530,6 +490,9 @@ class AdScheduler:
         
         logger.info("Scheduler stopped")
         
+        # Write counters recorded since the last periodic flush
+        self.stats.flush()
+        
         # Clean up Flask app context
         if hasattr(self, 'app_context'):
             self.app_context.pop()
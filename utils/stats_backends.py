@@ -0,0 +1,247 @@
+"""
+Storage backends for StatsTracker
+The web app and the scheduler record system stats from separate processes, so every
+backend applies an update as one atomic step against shared storage instead of
+rewriting a copy each process read earlier:
+- SQLiteStatsBackend keeps one row per counter and increments it in place (default)
+- JsonStatsBackend keeps the legacy data/stats.json, updated under a file lock and
+  replaced atomically so readers never see a partial file
+Updates are dicts of {(keyword, counter): amount}, keyword SYSTEM for system-wide counters.
+"""
+import os
+import json
+import sqlite3
+import logging
+import tempfile
+from contextlib import closing, contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows, the JSON file is then only replaced atomically
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 'sqlite' or 'json'
+STATS_BACKEND = os.getenv('STATS_BACKEND', 'sqlite')
+
+SYSTEM = ''
+CHECKS = 'checks'
+CHECK_DURATION_MS = 'check_duration_ms'
+RESTARTS = 'restarts'
+START_TIME = 'start_time'
+FOUND = 'found'
+DELETED = 'deleted'
+
+def stats_structure(stats):
+    """Fill in the sections of the stats dict served by /api/stats"""
+    stats.setdefault("checks", {"total": 0, "last_check": None, "avg_duration_ms": 0})
+    stats.setdefault("ads", {"total_found": 0, "total_deleted": 0, "by_keyword": {}})
+    stats.setdefault("system", {"start_time": datetime.now().isoformat(), "uptime_seconds": 0, "restarts": 0})
+    return stats
+
+def apply_increments(stats, increments, timestamps=None):
+    """Add increments to a stats dict in the /api/stats layout"""
+    timestamps = timestamps or {}
+    now = datetime.now().isoformat()
+    checks = stats["checks"]
+    new_checks = increments.get((SYSTEM, CHECKS), 0)
+    if new_checks:
+        total = checks["total"] + new_checks
+        duration_ms = checks["avg_duration_ms"] * checks["total"] + increments.get((SYSTEM, CHECK_DURATION_MS), 0)
+        checks["total"] = total
+        checks["avg_duration_ms"] = round(duration_ms / total, 2)
+        checks["last_check"] = timestamps.get((SYSTEM, CHECKS), now)
+    stats["system"]["restarts"] += increments.get((SYSTEM, RESTARTS), 0)
+
+    for (keyword, name), amount in increments.items():
+        if keyword == SYSTEM:
+            continue
+        keyword_stats = stats["ads"]["by_keyword"].setdefault(keyword, {"found": 0, "deleted": 0})
+        keyword_stats[name] = keyword_stats.get(name, 0) + amount
+        keyword_stats[f"last_{name}"] = timestamps.get((keyword, name), now)
+        stats["ads"][f"total_{name}"] += amount
+    return stats
+
+class SQLiteStatsBackend:
+    """Counters as rows of a SQLite table, each update is a single UPSERT transaction
+
+    The ads totals are sums over the keyword rows, so removing a keyword is one DELETE.
+    """
+
+    def __init__(self, path, legacy_file=None, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats_counters ("
+                " keyword TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " value REAL NOT NULL DEFAULT 0,"
+                " updated_at TEXT,"
+                " PRIMARY KEY (keyword, name))"
+            )
+            empty = conn.execute("SELECT 1 FROM stats_counters LIMIT 1").fetchone() is None
+        if empty and legacy_file:
+            self._import_legacy(legacy_file)
+
+    @contextmanager
+    def _transaction(self):
+        """Short-lived connection committing on success - connections are not shared across threads"""
+        with closing(sqlite3.connect(self.path, timeout=self.timeout)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                yield conn
+
+    def _import_legacy(self, legacy_file):
+        """Carry the counters of an existing stats.json over into a new database"""
+        legacy = JsonStatsBackend(legacy_file).load()
+        if not legacy:
+            return
+        stats = stats_structure(legacy)
+        checks = stats["checks"]
+        rows = [
+            (SYSTEM, CHECKS, checks.get("total", 0), checks.get("last_check")),
+            (SYSTEM, CHECK_DURATION_MS, checks.get("avg_duration_ms", 0) * checks.get("total", 0), None),
+            (SYSTEM, RESTARTS, stats["system"].get("restarts", 0), None),
+            (SYSTEM, START_TIME, 0, stats["system"].get("start_time")),
+        ]
+        for keyword, keyword_stats in stats["ads"]["by_keyword"].items():
+            rows.append((keyword, FOUND, keyword_stats.get("found", 0), keyword_stats.get("last_found")))
+            rows.append((keyword, DELETED, keyword_stats.get("deleted", 0), keyword_stats.get("last_deleted")))
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO stats_counters (keyword, name, value, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+        logger.info(f"Imported {len(rows)} counters from {legacy_file} into {self.path}")
+
+    def add(self, increments, timestamps=None):
+        """Add every amount to its counter, stamped with its time in timestamps (default now)"""
+        timestamps = timestamps or {}
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO stats_counters (keyword, name, value, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (keyword, name) DO UPDATE SET "
+                "value = value + excluded.value, updated_at = excluded.updated_at",
+                [(keyword, name, amount, timestamps.get((keyword, name), now)) for (keyword, name), amount in increments.items()]
+            )
+
+    def set_start_time(self, timestamp):
+        """Restart the uptime clock at timestamp (kept in the updated_at of its row)"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO stats_counters (keyword, name, value, updated_at) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT (keyword, name) DO UPDATE SET updated_at = excluded.updated_at",
+                (SYSTEM, START_TIME, timestamp)
+            )
+
+    def remove_keyword(self, keyword):
+        """Drop a keyword's counters, returns whether it had any"""
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM stats_counters WHERE keyword = ?", (keyword,)).rowcount > 0
+
+    def load(self):
+        """All counters in the /api/stats layout"""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT keyword, name, value, updated_at FROM stats_counters").fetchall()
+
+        stats = stats_structure({})
+        checks, ads, system = stats["checks"], stats["ads"], stats["system"]
+        duration_ms = 0
+        for keyword, name, value, updated_at in rows:
+            if keyword != SYSTEM:
+                keyword_stats = ads["by_keyword"].setdefault(keyword, {"found": 0, "deleted": 0})
+                keyword_stats[name] = int(value)
+                keyword_stats[f"last_{name}"] = updated_at
+                ads[f"total_{name}"] += int(value)
+            elif name == CHECKS:
+                checks["total"] = int(value)
+                checks["last_check"] = updated_at
+            elif name == CHECK_DURATION_MS:
+                duration_ms = value
+            elif name == RESTARTS:
+                system["restarts"] = int(value)
+            elif name == START_TIME:
+                system["start_time"] = updated_at
+
+        if checks["total"]:
+            checks["avg_duration_ms"] = round(duration_ms / checks["total"], 2)
+        return stats
+
+class JsonStatsBackend:
+    """The legacy stats.json, read-modify-written under an exclusive lock and replaced atomically"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    @contextmanager
+    def _update(self):
+        """Yield the current stats for changing in place, then write them back"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                # Released when the lock file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            stats = stats_structure(self._read())
+            yield stats
+            self._write(stats)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8-sig") as f:
+            return json.load(f)
+
+    def _write(self, stats):
+        # Write a sibling file and rename it over the old one, readers see either version whole
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.stats-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(stats, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def add(self, increments, timestamps=None):
+        """Add every amount to its counter, stamped with its time in timestamps (default now)"""
+        with self._update() as stats:
+            apply_increments(stats, increments, timestamps)
+
+    def set_start_time(self, timestamp):
+        """Restart the uptime clock at timestamp"""
+        with self._update() as stats:
+            stats["system"]["start_time"] = timestamp
+            stats["system"]["uptime_seconds"] = 0
+
+    def remove_keyword(self, keyword):
+        """Drop a keyword's counters and subtract them from the totals, returns whether it had any"""
+        with self._update() as stats:
+            keyword_stats = stats["ads"]["by_keyword"].pop(keyword, None)
+            if keyword_stats is None:
+                return False
+            stats["ads"]["total_found"] = max(0, stats["ads"]["total_found"] - keyword_stats.get("found", 0))
+            stats["ads"]["total_deleted"] = max(0, stats["ads"]["total_deleted"] - keyword_stats.get("deleted", 0))
+            return True
+
+    def load(self):
+        """The stats file, no lock needed as it is only ever replaced whole"""
+        try:
+            return self._read()
+        except Exception as e:
+            logger.error(f"Error loading stats file {self.path}: {e}")
+            return {}
+
+def create_backend(stats_file, backend=STATS_BACKEND):
+    """Backend named by STATS_BACKEND, the SQLite database lives next to stats_file"""
+    if backend == 'json':
+        return JsonStatsBackend(stats_file)
+    if backend == 'sqlite':
+        return SQLiteStatsBackend(f"{os.path.splitext(stats_file)[0]}.db", legacy_file=stats_file)
+    raise ValueError(f"Unknown STATS_BACKEND '{backend}', expected 'sqlite' or 'json'")
@@ -1,176 +1,156 @@
 import os
+import copy
 import time
-import json
+import atexit
+import threading
 from datetime import datetime
+from utils.stats_backends import (
+    apply_increments, create_backend, stats_structure, SYSTEM, CHECKS, CHECK_DURATION_MS, RESTARTS, FOUND, DELETED
+)
+
+# How often recorded counters are written to the backend and other processes' counters read back
+STATS_FLUSH_SECONDS = int(os.getenv('STATS_FLUSH_SECONDS', 30))
 
 
 class StatsTracker:
     """
     Class for tracking system statistics and metrics
+    Counters live in a backend shared by the web app and the scheduler (see utils.stats_backends).
+    Records only update memory, a background thread flushes them every flush_interval seconds
+    (and at exit) and reads back the other process's counters, so no request touches the disk.
     """
-    def __init__(self, stats_file="data/stats.json"):
+    def __init__(self, stats_file="data/stats.json", backend=None, flush_interval=STATS_FLUSH_SECONDS):
         self.stats_file = stats_file
+        self.backend = backend or create_backend(stats_file)
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._pending_times = {}
+        self._flusher_pid = None
         self.stats = self._load_stats()
         self._ensure_stats_structure()
+        atexit.register(self.flush)
     
     def _ensure_stats_structure(self):
         """Ensure stats has the expected structure"""
-        if "checks" not in self.stats:
-            self.stats["checks"] = {
-                "total": 0,
-                "last_check": None,
-                "avg_duration_ms": 0
-            }
-        
-        if "ads" not in self.stats:
-            self.stats["ads"] = {
-                "total_found": 0,
-                "total_deleted": 0,
-                "by_keyword": {}
-            }
-        
-        if "system" not in self.stats:
-            self.stats["system"] = {
-                "start_time": datetime.now().isoformat(),
-                "uptime_seconds": 0,
-                "restarts": 0
-            }
+        stats_structure(self.stats)
     
     def _load_stats(self):
-        """Load stats from file or create if doesn't exist"""
-        if os.path.exists(self.stats_file):
-            try:
-                with open(self.stats_file, "r", encoding="utf-8-sig") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading stats file: {e}")
-                return {}
-        return {}
-    
-    def save_stats(self):
-        """Save current stats to file"""
+        """Load stats from the backend"""
         try:
-            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
-            with open(self.stats_file, "w", encoding="utf-8") as f:
-                json.dump(self.stats, f, indent=2, ensure_ascii=False)
+            return self.backend.load()
         except Exception as e:
-            print(f"Error saving stats file: {e}")
+            print(f"Error loading stats: {e}")
+            return {}
+    
+    def _add(self, increments):
+        """Count increments in memory until the next flush"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            for key, amount in increments.items():
+                self._pending[key] = self._pending.get(key, 0) + amount
+                self._pending_times[key] = now
+            apply_increments(self.stats, increments, dict.fromkeys(increments, now))
+        self._start_flusher()
+    
+    def _start_flusher(self):
+        """Start the flush thread on first use (also after a fork, where it does not survive)"""
+        if self._flusher_pid != os.getpid():
+            with self._lock:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._flush_loop, name="stats-flush", daemon=True).start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Write pending counters to the backend and read back the combined stats"""
+        with self._lock:
+            if self._pending:
+                try:
+                    self.backend.add(self._pending, self._pending_times)
+                    self._pending, self._pending_times = {}, {}
+                except Exception as e:
+                    # Kept pending, the next flush retries
+                    print(f"Error saving stats: {e}")
+            return self.reload_stats_from_file()
 
     def reload_stats_from_file(self):
-        """Force reload stats from file - important for multi-process environments"""
+        """Refresh stats from the backend, including changes made by other processes"""
         try:
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, "r", encoding="utf-8-sig") as f:
-                    file_stats = json.load(f)
-                
-                # Update memory stats with file data, preserving structure
-                self.stats.update(file_stats)
-                self._ensure_stats_structure()
-                return True
-            else:
-                print(f"Stats file {self.stats_file} does not exist")
-                return False
+            with self._lock:
+                stats = stats_structure(self.backend.load())
+                # Counters recorded since the last flush are not in the backend yet
+                self.stats = apply_increments(stats, self._pending, self._pending_times)
+            return True
         except Exception as e:
-            print(f"Error reloading stats from file: {e}")
+            print(f"Error reloading stats: {e}")
             return False
     
     def record_check(self, duration_ms):
         """Record a completed check for ads"""
-        self.stats["checks"]["total"] += 1
-        self.stats["checks"]["last_check"] = datetime.now().isoformat()
-        
-        # Update average duration
-        total = self.stats["checks"]["total"]
-        current_avg = self.stats["checks"]["avg_duration_ms"]
-        new_avg = ((current_avg * (total - 1)) + duration_ms) / total
-        self.stats["checks"]["avg_duration_ms"] = round(new_avg, 2)
-        
-        self.save_stats()
+        self._add({(SYSTEM, CHECKS): 1, (SYSTEM, CHECK_DURATION_MS): duration_ms})
     
     def record_ads_found(self, keyword, count):
         """Record ads found for a specific keyword"""
-        self.stats["ads"]["total_found"] += count
-        
-        if keyword not in self.stats["ads"]["by_keyword"]:
-            self.stats["ads"]["by_keyword"][keyword] = {
-                "found": 0,
-                "deleted": 0,
-                "last_found": None
-            }
-        
-        self.stats["ads"]["by_keyword"][keyword]["found"] += count
-        self.stats["ads"]["by_keyword"][keyword]["last_found"] = datetime.now().isoformat()
-        
-        self.save_stats()
+        self._add({(keyword, FOUND): count})
     
     def record_ads_deleted(self, keyword, count):
         """Record ads deleted for a specific keyword"""
-        self.stats["ads"]["total_deleted"] += count
-        
-        if keyword not in self.stats["ads"]["by_keyword"]:
-            self.stats["ads"]["by_keyword"][keyword] = {
-                "found": 0, 
-                "deleted": 0,
-                "last_deleted": None
-            }
-        
-        self.stats["ads"]["by_keyword"][keyword]["deleted"] += count
-        self.stats["ads"]["by_keyword"][keyword]["last_deleted"] = datetime.now().isoformat()
-        
-        self.save_stats()
+        self._add({(keyword, DELETED): count})
     
     def update_uptime(self):
-        """Update system uptime"""
+        """Update system uptime (derived from the start time, so not saved)"""
         start_time = datetime.fromisoformat(self.stats["system"]["start_time"])
         now = datetime.now()
         self.stats["system"]["uptime_seconds"] = int((now - start_time).total_seconds())
-        self.save_stats()
     
     def record_system_start(self):
         """Record system start"""
-        self.stats["system"]["restarts"] += 1
-        self.save_stats()
+        self._add({(SYSTEM, RESTARTS): 1})
     
     def remove_keyword_stats(self, keyword):
         """Remove all stats for a deleted keyword"""
-        if keyword in self.stats["ads"]["by_keyword"]:
-            keyword_stats = self.stats["ads"]["by_keyword"][keyword]
-            
-            # Subtract the keyword's stats from totals
-            self.stats["ads"]["total_found"] -= keyword_stats.get("found", 0)
-            self.stats["ads"]["total_deleted"] -= keyword_stats.get("deleted", 0)
-            
-            # Ensure totals don't go negative
-            self.stats["ads"]["total_found"] = max(0, self.stats["ads"]["total_found"])
-            self.stats["ads"]["total_deleted"] = max(0, self.stats["ads"]["total_deleted"])
-            
-            # Remove the keyword from stats
-            del self.stats["ads"]["by_keyword"][keyword]
-            
+        try:
+            with self._lock:
+                pending_keys = [key for key in self._pending if key[0] == keyword]
+                for key in pending_keys:
+                    del self._pending[key]
+                    self._pending_times.pop(key, None)
+                removed = self.backend.remove_keyword(keyword) or bool(pending_keys)
+        except Exception as e:
+            print(f"Error removing stats for keyword '{keyword}': {e}")
+            return
+        
+        if removed:
             print(f"Removed stats for keyword '{keyword}'")
-            self.save_stats()
         else:
             print(f"No stats found for keyword '{keyword}' to remove")
+        self.reload_stats_from_file()
 
     def get_stats(self):
-        """Get current stats - always reload from file first for multi-process compatibility"""
-        # Force reload from file to get latest stats from other processes (e.g., scheduler)
-        self.reload_stats_from_file()
-        
-        self.update_uptime()
+        """Get current stats from memory - other processes' counters arrive with each flush"""
+        self._start_flusher()
         
         # Note: Unique ads count calculation from JSON files is deprecated
         # The system now uses database storage, and individual user stats
         # are managed by the UserService class
         
-        return self.stats
+        with self._lock:
+            self.update_uptime()
+            return copy.deepcopy(self.stats)
     
     def reset_uptime(self):
         """Reset system uptime and start time"""
-        self.stats["system"]["start_time"] = datetime.now().isoformat()
-        self.stats["system"]["uptime_seconds"] = 0
+        try:
+            self.backend.set_start_time(datetime.now().isoformat())
+        except Exception as e:
+            print(f"Error saving stats: {e}")
+        self.reload_stats_from_file()
         print("System uptime reset")
-        self.save_stats()
     
     def recalculate_stats_from_current_data(self, keywords_file="data/keywords.json", ads_file="data/ads.json"):
         """
@@ -179,71 +159,7 @@ class StatsTracker:
         The system now uses database storage and individual user stats.
         """
         print("WARNING: recalculate_stats_from_current_data() is deprecated - system now uses database storage")
-        return
-        try:
-            # Load current keywords
-            current_keywords = []
-            if os.path.exists(keywords_file):
-                with open(keywords_file, "r", encoding="utf-8-sig") as f:
-                    current_keywords = json.load(f)
-            
-            # Load current ads
-            current_ads = {}
-            if os.path.exists(ads_file):
-                with open(ads_file, "r", encoding="utf-8-sig") as f:
-                    current_ads = json.load(f)
-            
-            print("=" * 50)
-            print("RECALCULATING STATS FROM CURRENT DATA")
-            print("=" * 50)
-            print(f"Current keywords: {current_keywords}")
-            print(f"Current ads data keys: {list(current_ads.keys())}")
-              # Reset ad stats
-            unique_ads = set()  # Track unique ad IDs to avoid double counting
-            new_by_keyword = {}
-            
-            # Calculate stats based on current actual data
-            for keyword in current_keywords:
-                if keyword in current_ads:
-                    ad_count = len(current_ads[keyword])
-                    
-                    # Add unique ad IDs to the set
-                    for ad in current_ads[keyword]:
-                        if isinstance(ad, dict) and 'id' in ad:
-                            unique_ads.add(ad['id'])
-                    
-                    new_by_keyword[keyword] = {
-                        "found": ad_count,
-                        "deleted": 0,  # Reset deleted count since we can't track historical deletions
-                        "last_found": datetime.now().isoformat() if ad_count > 0 else None
-                    }
-                    print(f"Keyword '{keyword}': {ad_count} ads")
-                else:
-                    # Keyword exists but no ads found yet
-                    new_by_keyword[keyword] = {
-                        "found": 0,
-                        "deleted": 0,
-                        "last_found": None
-                    }
-                    print(f"Keyword '{keyword}': 0 ads")
-            
-            # Total unique ads count
-            total_unique_ads = len(unique_ads)
-            print(f"Total unique ads found: {total_unique_ads} (some ads may appear in multiple keywords)")
-              # Update stats with recalculated values
-            self.stats["ads"]["total_found"] = total_unique_ads
-            self.stats["ads"]["total_deleted"] = 0  # Reset since we can't track historical deletions
-            self.stats["ads"]["by_keyword"] = new_by_keyword
-            
-            print(f"Stats recalculated - Total unique ads: {total_unique_ads}")
-            print("=" * 50)
-            
-            self.save_stats()
-            return True
-            
-        except Exception as e:
-            print(f"Error recalculating stats: {e}")
-            return False
+        return False
     
     def cleanup_invalid_keywords(self, valid_keywords):
         """Remove stats for keywords that no longer exist"""